@@ -0,0 +1,281 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: analytics.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module is the live analytics stage between the
+# parser and the database: every device keeps a fixed-size ring buffer
+# per vital, from which moving average, spread and rolling min/max are
+# updated incrementally in constant time per sample. Readings outside
+# the physiological range or far from the moving average are rejected
+# as artifacts; accepted readings yield the smoothed "filtered" value
+# that is displayed and stored next to the raw one.
+# *****************************************************************************
+
+import math
+from array import array
+from collections import deque, namedtuple
+
+# ********************** Constants ************************
+WINDOW_SIZE = 32            # Readings in the moving window
+MIN_WINDOW = 5              # Readings needed before outliers are judged
+OUTLIER_SIGMAS = 3.0        # Distance from the moving average, in standard deviations, of an artifact
+MAX_REJECT_STREAK = 8       # Consecutive rejections taken as a real change of level
+VITALS = {
+    # name: (array typecode, lowest and highest plausible value, smallest spread)
+    'bpm': ('H', 25, 250, 5.0),
+    'oxygen_level': ('B', 50, 100, 1.0)
+}
+
+Reading = namedtuple('Reading', ['bpm', 'oxygen_level', 'bpm_filtered', 'oxygen_filtered'])
+
+
+class RingWindow:
+    """
+    *******************************
+    Class: RingWindow
+    -------------------
+    Fixed-size window over the most recent values, stored in a
+    preallocated typed array. Sum and sum of squares are updated as
+    values enter and leave, and monotonic queues keep the rolling
+    minimum and maximum, so every statistic costs O(1) per value.
+
+    Attributes:
+        count (int) - Values currently in the window
+    *******************************
+    """
+
+    def __init__(self, size=WINDOW_SIZE, typecode='H'):
+        self.values = array(typecode, [0]) * size
+        self.size = size
+        self.count = 0
+        self.pushed = 0
+        self.total = 0
+        self.total_sq = 0
+        self.lows = deque()     # (position, value), values increasing
+        self.highs = deque()    # (position, value), values decreasing
+
+    def push(self, value):
+        """
+        *******************************
+        Function: push
+        -------------------
+        Adds a value, evicting the oldest one once the window is full.
+
+        Input:  value (int)
+        Output: None
+        *******************************
+        """
+        position = self.pushed
+        slot = position % self.size
+        if self.count == self.size:
+            old = self.values[slot]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[slot] = value
+        self.total += value
+        self.total_sq += value * value
+        self.pushed = position + 1
+
+        lows, highs = self.lows, self.highs
+        while lows and lows[-1][1] >= value:
+            lows.pop()
+        lows.append((position, value))
+        while highs and highs[-1][1] <= value:
+            highs.pop()
+        highs.append((position, value))
+        oldest = position - self.size
+        if lows[0][0] <= oldest:
+            lows.popleft()
+        if highs[0][0] <= oldest:
+            highs.popleft()
+
+    def clear(self):
+        """
+        *******************************
+        Function: clear
+        -------------------
+        Empties the window.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        self.count = 0
+        self.total = 0
+        self.total_sq = 0
+        self.lows.clear()
+        self.highs.clear()
+
+    @property
+    def mean(self):
+        """
+        *******************************
+        Function: mean
+        -------------------
+        Mean of the values in the window.
+
+        Input:  None
+        Output: float or None if the window is empty
+        *******************************
+        """
+        return self.total / self.count if self.count else None
+
+    @property
+    def std(self):
+        """
+        *******************************
+        Function: std
+        -------------------
+        Population standard deviation of the values in the window.
+
+        Input:  None
+        Output: float or None if the window is empty
+        *******************************
+        """
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+
+    @property
+    def minimum(self):
+        """
+        *******************************
+        Function: minimum
+        -------------------
+        Smallest value in the window.
+
+        Input:  None
+        Output: number or None if the window is empty
+        *******************************
+        """
+        return self.lows[0][1] if self.lows else None
+
+    @property
+    def maximum(self):
+        """
+        *******************************
+        Function: maximum
+        -------------------
+        Largest value in the window.
+
+        Input:  None
+        Output: number or None if the window is empty
+        *******************************
+        """
+        return self.highs[0][1] if self.highs else None
+
+
+class VitalsAnalyzer:
+    """
+    *******************************
+    Class: VitalsAnalyzer
+    -------------------
+    Live analytics for the readings of one device: a RingWindow per
+    vital for the moving statistics, artifact rejection against them
+    and a summary of the whole session.
+
+    Attributes:
+        windows (dict) - {vital name: RingWindow}
+        session (dict) - {vital name: {'accepted', 'rejected',
+                          'total', 'min', 'max'}}
+    *******************************
+    """
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.windows = {name: RingWindow(window_size, typecode) for name, (typecode, _, _, _) in VITALS.items()}
+        self.streaks = dict.fromkeys(VITALS, 0)
+        self.session = {
+            name: {'accepted': 0, 'rejected': 0, 'total': 0, 'min': None, 'max': None}
+            for name in VITALS
+        }
+
+    def update(self, samples):
+        """
+        *******************************
+        Function: update
+        -------------------
+        Runs a batch of parsed samples through the analytics stage.
+
+        Input:  samples (list of protocol.Sample)
+        Output: list of Reading - The raw values plus the filtered
+                (moving average) values, None where a value is
+                missing or was rejected as an artifact
+        *******************************
+        """
+        filter_value = self.filter_value
+        return [Reading(bpm, oxygen_level, filter_value('bpm', bpm), filter_value('oxygen_level', oxygen_level))
+                for bpm, oxygen_level in samples]
+
+    def filter_value(self, name, value):
+        """
+        *******************************
+        Function: filter_value
+        -------------------
+        Checks one reading against the plausible range and the moving
+        window and, if accepted, adds it to the window. A reading more
+        than OUTLIER_SIGMAS standard deviations from the moving average
+        is an artifact, unless MAX_REJECT_STREAK readings in a row were,
+        in which case the level has really changed and the window
+        starts over from this reading.
+
+        Input:  name (str) - Key in VITALS
+                value (int or None)
+        Output: int or None - Rounded moving average after the reading,
+                None if the reading is missing or rejected
+        *******************************
+        """
+        if value is None:
+            return None
+        _, low, high, min_spread = VITALS[name]
+        window = self.windows[name]
+        stats = self.session[name]
+        if not low <= value <= high:
+            stats['rejected'] += 1
+            return None
+        if window.count >= MIN_WINDOW and abs(value - window.mean) > OUTLIER_SIGMAS * max(window.std, min_spread):
+            self.streaks[name] += 1
+            if self.streaks[name] < MAX_REJECT_STREAK:
+                stats['rejected'] += 1
+                return None
+            window.clear()
+        self.streaks[name] = 0
+        window.push(value)
+        stats['accepted'] += 1
+        stats['total'] += value
+        if stats['min'] is None or value < stats['min']:
+            stats['min'] = value
+        if stats['max'] is None or value > stats['max']:
+            stats['max'] = value
+        return round(window.total / window.count)
+
+    def summary(self):
+        """
+        *******************************
+        Function: summary
+        -------------------
+        Returns the session summary of every vital.
+
+        Input:  None
+        Output: dict - {vital name: {'accepted', 'rejected', 'mean',
+                'min', 'max'}}, mean/min/max None without readings
+        *******************************
+        """
+        return {
+            name: {
+                'accepted': stats['accepted'],
+                'rejected': stats['rejected'],
+                'mean': stats['total'] / stats['accepted'] if stats['accepted'] else None,
+                'min': stats['min'],
+                'max': stats['max']
+            }
+            for name, stats in self.session.items()
+        }
@@ -0,0 +1,296 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: benchmark.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module benchmarks ingestion without hardware:
+# it starts virtual devices from simulator.py, runs the logging engine
+# of serial_handler against them and reports sustained samples/sec,
+# send-to-commit latency percentiles and dropped samples for each
+# storage backend. Every backend runs in its own process. It also
+# times the start of the terminal app for commands that must not touch
+# the database and fails if they are not well under STARTUP_LIMIT_MS.
+#
+# Usage: python benchmark.py ingest --backends sqlite mysql --devices 4 --rate 200
+#        python benchmark.py startup --runs 5
+#
+# *****************************************************************************
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+# ********************** Constants ************************
+DRAIN_TIME = 2.0            # Seconds ingestion keeps running after the devices stop
+BENCH_USER_PREFIX = "bench_device_"
+STARTUP_LIMIT_MS = 100.0    # Slowest acceptable start for commands without database access
+STARTUP_COMMANDS = ['help', 'exit']
+
+
+def percentile(values, fraction):
+    """
+    *******************************
+    Function: percentile
+    -------------------
+    Returns the value below which the given fraction of values lie
+    (nearest-rank method).
+
+    Input:  values (sorted list of float), fraction (float) - 0..1
+    Output: float or None if values is empty
+    *******************************
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def run_ingest(backend, path, devices, rate, jitter, malformed, duration, seed=None):
+    """
+    *******************************
+    Function: run_ingest
+    -------------------
+    Runs one ingestion benchmark in this process against the given
+    backend. Must run before anything in this process has queried the
+    database, as the backend is chosen on the first connection.
+
+    Input:  backend (str)   - 'mysql' or 'sqlite'
+            path (str)      - SQLite database file (sqlite only)
+            devices (int), rate (float), jitter (float),
+            malformed (float) - Simulator settings, see simulator.py
+            duration (float) - Seconds the devices send data
+            seed (int or None)
+    Output: dict - Benchmark results
+    *******************************
+    """
+    import config
+    config.DB_CONFIG.update({'backend': backend, 'path': path})
+    import asyncio
+    import database
+    import serial_handler
+    from simulator import start_simulator, start_writers, stop_simulator
+
+    user_ids = []
+    for index in range(devices):
+        username = f"{BENCH_USER_PREFIX}{index}"
+        if not database.get_user_id(username):
+            database.add_user(username, 0)
+        user_ids.append(database.get_user_id(username))
+        database.delete_logs(user_ids[-1])
+
+    # The devices start sending once ingest has opened every port, as
+    # opening a port discards what was sent to it before
+    simulated = start_simulator(devices, rate, jitter, malformed, seed, start=False)
+    device_of = dict(zip(user_ids, simulated))
+    committed = {user_id: 0 for user_id in user_ids}
+    latencies = []
+
+    def on_flush(rows):
+        now = time.monotonic()
+        for row in rows:
+            user_id = row[0]
+            device = device_of.get(user_id)
+            if device is None:
+                continue
+            index = committed[user_id]
+            committed[user_id] += 1
+            if index < len(device['sent']):
+                latencies.append(now - device['sent'][index])
+
+    database.add_flush_listener(on_flush)
+    stopper = threading.Timer(duration, stop_simulator, args=(simulated,))
+
+    def on_open():
+        start_writers(simulated)
+        stopper.start()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            counters = asyncio.run(serial_handler.ingest(
+                {device['port']: user_id for user_id, device in device_of.items()},
+                duration=duration + DRAIN_TIME,
+                keyboard=False,
+                spool_path=path + ".spool",
+                on_open=on_open
+            ))
+    finally:
+        if stopper.ident is not None:
+            stopper.join()
+        else:
+            stop_simulator(simulated)
+        database.remove_flush_listener(on_flush)
+
+    sent = sum(len(device['sent']) for device in simulated)
+    stored = sum(committed.values())
+    latencies.sort()
+    for user_id in user_ids:
+        database.delete_logs(user_id)
+    return {
+        'backend': backend,
+        'devices': devices,
+        'sent': sent,
+        'stored': stored,
+        'dropped': sent - stored,
+        'malformed_sent': sum(device['malformed'] for device in simulated),
+        'malformed_seen': sum(counter['errors'] for counter in counters.values()),
+        'samples_per_sec': stored / duration,
+        'latency_ms': {
+            name: None if value is None else value * 1000.0
+            for name, value in (('p50', percentile(latencies, 0.50)),
+                                ('p95', percentile(latencies, 0.95)),
+                                ('p99', percentile(latencies, 0.99)),
+                                ('max', latencies[-1] if latencies else None))
+        }
+    }
+
+
+def run_startup(command, runs):
+    """
+    *******************************
+    Function: run_startup
+    -------------------
+    Starts main.py in a fresh process the given number of times, types
+    the command followed by 'exit', and measures the wall-clock time
+    until the process ends. Runs in a scratch directory whose db.cfg
+    points at a SQLite file, so any database access would create it.
+
+    Input:  command (str) - Command that must not touch the database
+            runs (int)
+    Output: dict - Timings in ms and whether the database was touched
+    *******************************
+    """
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    lines = "exit\n" if command == "exit" else f"{command}\nexit\n"
+    timings = []
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, "startup.db")
+        with open(os.path.join(scratch, "db.cfg"), "w") as f:
+            json.dump({'backend': "sqlite", 'path': db_path}, f)
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, main_path], input=lines, cwd=scratch,
+                           capture_output=True, text=True, check=True)
+            timings.append((time.perf_counter() - start) * 1000.0)
+        touched = os.path.exists(db_path)
+    timings.sort()
+    return {
+        'command': command,
+        'median_ms': percentile(timings, 0.50),
+        'max_ms': timings[-1],
+        'db_touched': touched
+    }
+
+
+def print_report(results):
+    """
+    *******************************
+    Function: print_report
+    -------------------
+    Prints one line of ingestion results per backend, or of startup
+    results per command.
+
+    Input:  results (list of dict) - Results of run_ingest or run_startup
+    Output: None
+    *******************************
+    """
+    if results and 'command' in results[0]:
+        print(f"{'Command':<10}{'Median ms':>12}{'Max ms':>10}{'DB':>6}  Result")
+        for result in results:
+            ok = result['median_ms'] < STARTUP_LIMIT_MS and not result['db_touched']
+            print(f"{result['command']:<10}{result['median_ms']:>12.1f}{result['max_ms']:>10.1f}"
+                  f"{'yes' if result['db_touched'] else 'no':>6}  {'ok' if ok else 'FAIL'}")
+        return
+    print(f"{'Backend':<10}{'Samples/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'Sent':>10}{'Dropped':>10}{'Malformed':>11}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['backend']:<10} failed: {result['error']}")
+            continue
+        latency = result['latency_ms']
+        cells = "".join(f"{'-' if latency[k] is None else format(latency[k], '.1f'):>10}"
+                        for k in ('p50', 'p95', 'p99', 'max'))
+        print(f"{result['backend']:<10}{result['samples_per_sec']:>12.1f}{cells}"
+              f"{result['sent']:>10}{result['dropped']:>10}{result['malformed_seen']:>11}")
+
+
+def main():
+    """
+    *******************************
+    Function: main
+    -------------------
+    Command line entry point. 'ingest' runs the ingestion benchmark
+    once per backend, each in a fresh process; 'startup' times the app
+    start for commands without database access and exits with status 1
+    if one is too slow or touched the database.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    parser = argparse.ArgumentParser(description="BPM terminal app benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="ingestion throughput and latency per storage backend")
+    ingest.add_argument("--backends", nargs="+", default=["sqlite"], choices=["sqlite", "mysql"])
+    ingest.add_argument("--path", default=None, help="SQLite file (default: a temporary file)")
+    ingest.add_argument("--devices", type=int, default=1)
+    ingest.add_argument("--rate", type=float, default=100.0, help="lines per second per device")
+    ingest.add_argument("--jitter", type=float, default=0.0)
+    ingest.add_argument("--malformed", type=float, default=0.0)
+    ingest.add_argument("--duration", type=float, default=10.0, help="seconds the devices send data")
+    ingest.add_argument("--seed", type=int, default=None)
+    ingest.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+
+    startup = commands.add_parser("startup", help="start time of commands that do not touch the database")
+    startup.add_argument("--runs", type=int, default=5, help="starts per command")
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        results = [run_startup(command, args.runs) for command in STARTUP_COMMANDS]
+        print_report(results)
+        if any(r['median_ms'] >= STARTUP_LIMIT_MS or r['db_touched'] for r in results):
+            sys.exit(1)
+        return
+
+    if args.command == "ingest":
+        if args.child:
+            result = run_ingest(args.backends[0], args.path, args.devices, args.rate,
+                                args.jitter, args.malformed, args.duration, args.seed)
+            print(json.dumps(result))
+            return
+
+        results = []
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as scratch:
+                path = args.path or os.path.join(scratch, "benchmark.db")
+                command = [sys.executable, os.path.abspath(__file__), "ingest", "--child",
+                           "--backends", backend, "--path", path,
+                           "--devices", str(args.devices), "--rate", str(args.rate),
+                           "--jitter", str(args.jitter), "--malformed", str(args.malformed),
+                           "--duration", str(args.duration)]
+                if args.seed is not None:
+                    command += ["--seed", str(args.seed)]
+                print(f"Running ingest benchmark on {backend}...")
+                child = subprocess.run(command, capture_output=True, text=True)
+                if child.returncode == 0:
+                    results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+                else:
+                    error = (child.stderr.strip().splitlines() or ["unknown error"])[-1]
+                    results.append({'backend': backend, 'error': error})
+        print_report(results)
+        if any('error' in result for result in results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
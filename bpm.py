@@ -0,0 +1,353 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: bpm.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This is the headless command line interface for
+# scripts and cron jobs: every operation is a subcommand that takes
+# its settings as arguments, never prompts (database connection
+# failures are errors) and ends with an exit code. It reuses the
+# implementations behind the terminal commands and imports only what
+# the chosen subcommand needs.
+#
+# Usage: python bpm.py export --type all --user all --format csv.gz
+#        python bpm.py export --user each --per-day --since 2024-05-01
+#        python bpm.py import bpm_logs_*.csv --create-users
+#        python bpm.py ingest --device COM5=alice --duration 3600
+#        python bpm.py ingest --device COM6=bob --spool bob.spool
+#        python bpm.py compact --retention-days 30
+#        python bpm.py delete-logs --user alice
+#        python bpm.py add-user alice 34
+#
+# A spool file is used by one process at a time: parallel ingest runs
+# need a --spool of their own. Readings a run could not load into the
+# database stay in its spool and are loaded by the next run using it.
+#
+# Exit codes: 0 success, 1 failure, 2 invalid arguments, 130 interrupted.
+#
+# *****************************************************************************
+
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+# ********************** Constants ************************
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+LOG_TYPES = ['bpm', 'oxygen', 'all']
+EXPORT_FORMATS = ['csv', 'csv.gz', 'npz', 'parquet']
+
+
+def fail(message, code=EXIT_FAILURE):
+    """
+    *******************************
+    Function: fail
+    -------------------
+    Prints an error message to stderr.
+
+    Input:  message (str), code (int) - Exit code to return
+    Output: int - code
+    *******************************
+    """
+    print(f"bpm: {message}", file=sys.stderr)
+    return code
+
+
+def device_pair(text):
+    """
+    *******************************
+    Function: device_pair
+    -------------------
+    Parses a "PORT=USERNAME" argument.
+
+    Input:  text (str)
+    Output: Tuple (port, username)
+    *******************************
+    """
+    port, separator, username = text.partition("=")
+    if not separator or not port or not username:
+        raise argparse.ArgumentTypeError(f"expected PORT=USERNAME, got '{text}'")
+    return port, username
+
+
+def time_range(args):
+    """
+    *******************************
+    Function: time_range
+    -------------------
+    Returns the [start, end) range given by --since/--until or --minutes.
+
+    Input:  args (argparse.Namespace)
+    Output: Tuple (start, end) of datetime or None
+    *******************************
+    """
+    if args.minutes is not None:
+        return datetime.now() - timedelta(minutes=args.minutes), args.until
+    return args.since, args.until
+
+
+def run_export(args):
+    """
+    *******************************
+    Function: run_export
+    -------------------
+    Exports logs like 'output_to_csv': of one user or all users to one
+    file per log type, or with --user each to files per user (and day).
+
+    Input:  args (argparse.Namespace)
+    Output: int - Exit code
+    *******************************
+    """
+    from commands import export_logs, EXPORT_HEADERS
+    from database import get_user_id, load_user_ids
+    start, end = time_range(args)
+    log_types = ['bpm', 'oxygen'] if args.type == 'all' else [args.type]
+    username = args.user.lower()
+    os.makedirs(args.dir, exist_ok=True)
+
+    if username == 'each':
+        if args.format not in ['csv', 'csv.gz']:
+            return fail("per-user exports are written as csv or csv.gz", EXIT_USAGE)
+        from export import export_per_user
+        users = {user_id: name for name, user_id in load_user_ids().items()}
+        folder = os.path.join(args.dir, f"logs_per_user_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        files, rows = export_per_user(users, {log_type: EXPORT_HEADERS[log_type] for log_type in log_types},
+                                      folder, args.per_day, args.format == 'csv.gz', start, end, max(1, args.workers))
+        print(f"Exported {rows} readings to {files} files in '{folder}'.")
+        return EXIT_OK
+
+    if username != 'all' and not get_user_id(username):
+        return fail(f"user '{args.user}' not found")
+    for log_type in log_types:
+        export_logs(log_type, username, args.format, args.dir, start, end)
+    return EXIT_OK
+
+
+def run_import(args):
+    """
+    *******************************
+    Function: run_import
+    -------------------
+    Bulk-imports export and capture files like 'import'. Fails if any
+    file could not be read; the readings of the others are kept.
+
+    Input:  args (argparse.Namespace)
+    Output: int - Exit code
+    *******************************
+    """
+    from importer import import_files
+    paths = [path for path in args.files if os.path.isfile(path)]
+    for path in sorted(set(args.files) - set(paths)):
+        fail(f"'{path}' is not a file")
+    stats = import_files(paths, args.user and args.user.lower(), args.create_users, max(1, args.workers))
+    print(f"Imported {stats['rows']} readings, skipped {stats['malformed']} malformed lines "
+          f"and {stats['skipped']} readings of unknown users.")
+    if stats['unknown']:
+        fail(f"unknown users: {', '.join(sorted(stats['unknown']))}")
+    for path, error in stats['failed']:
+        fail(f"could not import '{path}': {error}")
+    return EXIT_FAILURE if stats['failed'] or len(paths) < len(args.files) else EXIT_OK
+
+
+def run_ingest(args):
+    """
+    *******************************
+    Function: run_ingest
+    -------------------
+    Logs from serial devices through the spool like 'log_bio_multi',
+    for --duration seconds or until SIGINT/SIGTERM, which stop it
+    normally: the spool is drained and the counters are printed. A
+    second signal interrupts the drain. The devices come from
+    --device, or from devices.cfg. Fails if no port could be opened
+    or the --spool file is in use by another process.
+
+    Input:  args (argparse.Namespace)
+    Output: int - Exit code
+    *******************************
+    """
+    import asyncio
+    import config
+    from database import get_user_id
+    pairs = args.device or list(config.load_devices().items())
+    if not pairs:
+        return fail("no devices given; use --device PORT=USERNAME or set_devices", EXIT_USAGE)
+    devices = {}
+    for port, username in pairs:
+        user_id = get_user_id(username)
+        if not user_id:
+            return fail(f"user '{username}' for port '{port}' not found")
+        devices[port] = user_id
+
+    from serial_handler import ingest
+    from spool import SPOOL_FILE
+    counters = asyncio.run(ingest(devices, duration=args.duration, keyboard=False,
+                                  spool_path=args.spool or SPOOL_FILE, stop_signals=True))
+    for port, counter in counters.items():
+        print(f"{port}: {counter['samples']} samples, {counter['errors']} malformed lines")
+    if all('error' in counter for counter in counters.values()):
+        return fail("no serial port could be opened")
+    return EXIT_OK
+
+
+def run_compact(args):
+    """
+    *******************************
+    Function: run_compact
+    -------------------
+    Compacts raw readings older than the retention window like 'compact'.
+
+    Input:  args (argparse.Namespace)
+    Output: int - Exit code
+    *******************************
+    """
+    from database import compact
+    purged = compact(args.retention_days)
+    print(f"Compacted {purged} readings.")
+    return EXIT_OK
+
+
+def run_delete_logs(args):
+    """
+    *******************************
+    Function: run_delete_logs
+    -------------------
+    Deletes the logs of one user, or of all users, like 'delete_logs'.
+
+    Input:  args (argparse.Namespace)
+    Output: int - Exit code
+    *******************************
+    """
+    from database import delete_logs, get_user_id
+    if args.all:
+        delete_logs()
+        print("All logs have been deleted.")
+        return EXIT_OK
+    user_id = get_user_id(args.user)
+    if not user_id:
+        return fail(f"user '{args.user}' not found")
+    deleted = delete_logs(user_id)
+    print(f"Deleted {deleted} readings of user '{args.user}'.")
+    return EXIT_OK
+
+
+def run_add_user(args):
+    """
+    *******************************
+    Function: run_add_user
+    -------------------
+    Adds a user like 'add_user'. Fails if the username is taken.
+
+    Input:  args (argparse.Namespace)
+    Output: int - Exit code
+    *******************************
+    """
+    from database import add_user, get_user_id
+    if get_user_id(args.username):
+        return fail(f"user '{args.username}' already exists")
+    add_user(args.username, args.age)
+    print(f"User '{args.username}' added.")
+    return EXIT_OK
+
+
+def build_parser():
+    """
+    *******************************
+    Function: build_parser
+    -------------------
+    Builds the argument parser with one subparser per operation.
+
+    Input:  None
+    Output: argparse.ArgumentParser
+    *******************************
+    """
+    parser = argparse.ArgumentParser(prog="bpm", description="BPM terminal app, batch mode")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="export logs to files")
+    export.add_argument("--type", choices=LOG_TYPES, default="all", help="log type (default: all)")
+    export.add_argument("--user", default="all", help="username, 'all' for one file of all users "
+                                                      "or 'each' for a file per user (default: all)")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument("--dir", default=".", help="output directory (default: current)")
+    first = export.add_mutually_exclusive_group()
+    first.add_argument("--since", type=datetime.fromisoformat, help="first time stamp, ISO format")
+    first.add_argument("--minutes", type=float, help="only the last N minutes")
+    export.add_argument("--until", type=datetime.fromisoformat, help="end of the range (exclusive), ISO format")
+    export.add_argument("--per-day", action="store_true", help="with --user each: one file per user and day")
+    export.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="with --user each: worker processes (default: number of cores)")
+    export.set_defaults(handler=run_export)
+
+    importing = commands.add_parser("import", help="bulk-import CSV exports and raw captures")
+    importing.add_argument("files", nargs="+")
+    importing.add_argument("--user", help="user of captures and single-user exports (default: from the file name)")
+    importing.add_argument("--create-users", action="store_true", help="add users that do not exist")
+    importing.add_argument("--workers", type=int, default=1, help="parser processes (default: 1)")
+    importing.set_defaults(handler=run_import)
+
+    ingest = commands.add_parser("ingest", help="log from serial devices until stopped")
+    ingest.add_argument("--device", type=device_pair, action="append", metavar="PORT=USERNAME",
+                        help="device to log, repeatable (default: devices.cfg)")
+    ingest.add_argument("--duration", type=float, help="seconds to log (default: until SIGINT/SIGTERM)")
+    ingest.add_argument("--spool", help="spool file, one per parallel run (default: the terminal app's)")
+    ingest.set_defaults(handler=run_ingest)
+
+    compact = commands.add_parser("compact", help="roll old raw logs into summaries")
+    compact.add_argument("--retention-days", type=float, help="days of raw logs to keep (default: db.cfg)")
+    compact.set_defaults(handler=run_compact)
+
+    delete = commands.add_parser("delete-logs", help="delete the logs of a user or of all users")
+    target = delete.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user")
+    target.add_argument("--all", action="store_true")
+    delete.set_defaults(handler=run_delete_logs)
+
+    add = commands.add_parser("add-user", help="add a user")
+    add.add_argument("username")
+    add.add_argument("age", type=int)
+    add.set_defaults(handler=run_add_user)
+    return parser
+
+
+def main(argv=None):
+    """
+    *******************************
+    Function: main
+    -------------------
+    Command line entry point. Runs one subcommand without prompts,
+    closes the spool and the connection pool, and exits with the
+    subcommand's exit code (argparse exits with 2 on invalid arguments).
+
+    Input:  argv (list of str or None) - Arguments, default sys.argv[1:]
+    Output: None
+    *******************************
+    """
+    args = build_parser().parse_args(argv)
+    import database
+    database.disable_prompts()
+    try:
+        code = args.handler(args)
+    except KeyboardInterrupt:
+        code = fail("interrupted", EXIT_INTERRUPTED)
+    except Exception as e:
+        code = fail(str(e))
+    finally:
+        if 'spool' in sys.modules:
+            sys.modules['spool'].close_spool()
+        database.close_pool()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    # Lets the export and import worker processes start in a frozen executable
+    import multiprocessing
+    multiprocessing.freeze_support()
+    main()
@@ -14,14 +14,15 @@
 
 import os
 import sys
-import csv
-from datetime import datetime
-from config import save_comport, COMPORT, BAUDRATE
+import itertools
+from datetime import datetime, timedelta
+import config
+from config import save_comport, load_devices, save_devices
 from database import (
-    add_user, remove_user, get_user_id, get_all_bpm_logs, get_user_bpm_logs,
-    get_all_oxygen_logs, get_user_oxygen_logs, delete_logs
+    add_user, remove_user, get_user_id, load_user_ids, delete_logs, iter_log_chunks,
+    iter_log_pages, get_log_summary, compact, close_pool, SUMMARY_BUCKETS, EXPORT_CHUNK_SIZE
 )
-from serial_handler import log_bio
+from spool import close_spool
 
 
 def clear():
@@ -53,12 +54,18 @@ def get_available_commands():
         'add_user':     'Add a new user to the system',
         'remove_user':  'Remove an existing user from the system',
         'set_user':     'Set the current user',
-        'show_bpm_log': 'Show the BPM log of users',
-        'show_oxygen_log': 'Show the oxygen level log of users',
+        'show_bpm_log': 'Show the BPM log of users, raw or summarized per minute/hour/day',
+        'show_oxygen_log': 'Show the oxygen level log of users, raw or summarized per minute/hour/day',
         'log_bio':      'Log Bio-Metrics data from the COM port',
-        'output_to_csv':'Output the BPM and oxygen logs to a CSV file',
+        'log_bio_multi':'Log Bio-Metrics data from all configured devices at once',
+        'set_devices':  'Set which user is logged from each COM port in multi-device mode',
+        'output_to_csv':'Output the BPM and oxygen logs to a CSV, CSV.gz, NPZ or Parquet file',
+        'import':       'Import BPM and oxygen logs from CSV exports or raw device captures',
         'set_comport':  'Set the COM port and baudrate for UART communication',
         'delete_logs':  'Delete logs for a specific user or all users',
+        'stats':        'Show ingest metrics: throughput, error rate, queue depths and stage latencies',
+        'compact':      'Roll old raw logs into per-minute/hour summaries and purge them',
+        'profile':      'Run a command under the profiler, e.g. "profile show_bpm_log"',
         'help':         'Show available commands',
         'clear':        'Clear the console output',
         'exit':         'Exit the application'
@@ -77,6 +84,14 @@ def execute_command(command):
     *******************************
     """
     cmd = command.lower()
+    if cmd.split(maxsplit=1)[:1] == ['profile']:
+        target = cmd[len('profile'):].strip()
+        if target:
+            from profiler import profile_command
+            profile_command(target, execute_command)
+        else:
+            print("Usage: profile <command>")
+        return
     if cmd == 'add_user':
         username = input("Enter username: ").strip()
         age = int(input("Enter age: ").strip())
@@ -96,56 +111,62 @@ def execute_command(command):
             print(f"User '{username}' not found.")
     elif cmd == 'show_bpm_log':
         username = input("Enter username to view BPM logs or 'all' to view all users' BPM logs: ").strip().lower()
-        if username == "all":
-            rows = get_all_bpm_logs()
-            if rows:
-                print("BPM log for all users (sorted by username):")
-                for username, bpm, timestamp in rows:
-                    print(f"Username: {username}, BPM: {bpm}, Timestamp: {timestamp}")
-            else:
-                print("No BPM logs found.")
-        else:
-            rows = get_user_bpm_logs(username)
-            if rows:
-                print(f"BPM log for user '{username}' (sorted by timestamp):")
-                for bpm, timestamp in rows:
-                    print(f"BPM: {bpm}, Timestamp: {timestamp}")
-            else:
-                print(f"No BPM log found for user '{username}'.")
+        show_log('bpm', username)
     elif cmd == 'show_oxygen_log':
         username = input("Enter username to view oxygen level logs or 'all' to view all users' oxygen level logs: ").strip().lower()
-        if username == "all":
-            rows = get_all_oxygen_logs()
-            if rows:
-                print("Oxygen level log for all users (sorted by username):")
-                for username, oxygen_level, timestamp in rows:
-                    print(f"Username: {username}, Oxygen Level: {oxygen_level}%, Timestamp: {timestamp}")
-            else:
-                print("No oxygen level logs found.")
-        else:
-            rows = get_user_oxygen_logs(username)
-            if rows:
-                print(f"Oxygen level log for user '{username}' (sorted by timestamp):")
-                for oxygen_level, timestamp in rows:
-                    print(f"Oxygen Level: {oxygen_level}%, Timestamp: {timestamp}")
-            else:
-                print(f"No oxygen level log found for user '{username}'.")
+        show_log('oxygen', username)
     elif cmd == 'log_bio':
         if current_user['id'] is None:
             print("No user is currently logged in. Please set a user first.")
         else:
+            from serial_handler import log_bio
             log_bio(current_user['id'])
+    elif cmd == 'log_bio_multi':
+        devices = {}
+        for port, username in load_devices().items():
+            user_id = get_user_id(username)
+            if not user_id:
+                print(f"User '{username}' for port '{port}' not found.")
+                return
+            devices[port] = user_id
+        if devices:
+            from serial_handler import log_bio_multi
+            log_bio_multi(devices)
+        else:
+            print("No devices configured. Use 'set_devices' first.")
+    elif cmd == 'set_devices':
+        devices = load_devices()
+        print(f"Current devices: {devices or 'none'}")
+        print("Enter one 'port username' pair per line, empty line to finish:")
+        entries = {}
+        while True:
+            entry = input("  ").strip()
+            if not entry:
+                break
+            try:
+                port, username = entry.split()
+            except ValueError:
+                print("Invalid entry. Use the form 'port username'.")
+                continue
+            entries[port] = username
+        if entries:
+            save_devices(entries)
+            print(f"Devices set to {entries}.")
+        else:
+            print("No changes made.")
     elif cmd == 'output_to_csv':
         output_to_csv()
+    elif cmd == 'import':
+        import_logs()
     elif cmd == 'set_comport':
-        comport = input(f"Enter the COM port (current: {COMPORT}): ").strip() or COMPORT
+        comport = input(f"Enter the COM port (current: {config.COMPORT}): ").strip() or config.COMPORT
         try:
-            baudrate = int(input(f"Enter the baud rate (current: {BAUDRATE}): ").strip() or BAUDRATE)
+            baudrate = int(input(f"Enter the baud rate (current: {config.BAUDRATE}): ").strip() or config.BAUDRATE)
         except ValueError:
             print("Invalid baudrate. Keeping previous value.")
-            baudrate = BAUDRATE
+            baudrate = config.BAUDRATE
         save_comport(comport, baudrate)
-        print(f"COM port set to '{comport}' with baud rate '{baudrate}'. Please restart the program for changes to take effect.")
+        print(f"COM port set to '{comport}' with baud rate '{baudrate}'.")
     elif cmd == 'delete_logs':
         username = input("Enter the username to delete logs for, or 'all' to delete logs for all users: ").strip().lower()
         if username == "all":
@@ -154,10 +175,28 @@ def execute_command(command):
         else:
             user_id = get_user_id(username)
             if user_id:
-                delete_logs(user_id)
+                deleted = delete_logs(user_id, progress=lambda count, total: print(
+                    f"\r  {count} of {total} rows deleted", end="", flush=True))
+                if deleted:
+                    print()
                 print(f"Logs for user '{username}' have been deleted.")
             else:
                 print(f"User '{username}' not found.")
+    elif cmd == 'compact':
+        retention = config.DB_CONFIG['retention_days']
+        try:
+            retention = float(input(f"Keep raw logs for how many days (default: {retention}): ").strip() or retention)
+        except ValueError:
+            print("Invalid number of days.")
+            return
+        purged = compact(retention, progress=lambda count, fraction: print(
+            f"\r  {count} readings compacted ({fraction:.0%})", end="", flush=True))
+        if purged:
+            print()
+        print(f"Compacted {purged} readings older than {retention:g} days.")
+    elif cmd == 'stats':
+        import metrics
+        print(metrics.format_stats())
     elif cmd == 'clear':
         clear()
     elif cmd == 'help':
@@ -166,18 +205,148 @@ def execute_command(command):
             print(f"{cmd}: {desc}")
     elif cmd == 'exit':
         print("Exiting the application.")
+        close_spool()
+        close_pool()
         sys.exit(0)
     else:
         print(f"Unknown command: {command}. Type 'help' for a list of commands.")
 
 
+def prompt_log_view():
+    """
+    *******************************
+    Function: prompt_log_view
+    -------------------
+    Asks whether to show every reading or a per-minute, per-hour or
+    per-day summary.
+
+    Input:  None
+    Output: str or None - 'raw' or a summary bucket, None if invalid
+    *******************************
+    """
+    views = ['raw'] + SUMMARY_BUCKETS
+    view = input("Enter 'raw' to view every reading, or 'minute', 'hour' or 'day' for a summary (default: raw): ").strip().lower() or "raw"
+    if view not in views:
+        print(f"Invalid view. Please enter one of: {', '.join(views)}.")
+        return None
+    return view
+
+
+def prompt_time_range():
+    """
+    *******************************
+    Function: prompt_time_range
+    -------------------
+    Asks how many minutes of history to use.
+
+    Input:  None
+    Output: Tuple (start, end) of datetime or None - (None, None) for
+            the full history; None if the input is invalid
+    *******************************
+    """
+    minutes = input("Enter how many minutes back to include, or press Enter for the full history: ").strip()
+    if not minutes:
+        return None, None
+    try:
+        minutes = float(minutes)
+    except ValueError:
+        minutes = -1
+    if minutes <= 0:
+        print("Invalid number of minutes.")
+        return None
+    return datetime.now() - timedelta(minutes=minutes), None
+
+
+def show_log(log_type, username):
+    """
+    *******************************
+    Function: show_log
+    -------------------
+    Shows the BPM or oxygen logs of one user or all users, either raw
+    or summarized, for the full history or the last N minutes. Raw
+    rows are fetched and shown one page at a time.
+
+    Input:  log_type (str) - 'bpm' or 'oxygen'
+            username (str) - Username or 'all'
+    Output: None
+    *******************************
+    """
+    view = prompt_log_view()
+    if view is None:
+        return
+    time_range = prompt_time_range()
+    if time_range is None:
+        return
+    start, end = time_range
+    if view != "raw":
+        show_log_summary(log_type, username, view, start, end)
+        return
+
+    label = EXPORT_LABELS[log_type]
+    title = label[0].upper() + label[1:]
+    value_name = EXPORT_HEADERS[log_type]
+    unit = "%" if log_type == 'oxygen' else ""
+    all_users = username == "all"
+    shown = 0
+    for rows in iter_log_pages(log_type, None if all_users else username, start, end):
+        if shown == 0:
+            if all_users:
+                print(f"{title} log for all users (sorted by username):")
+            else:
+                print(f"{title} log for user '{username}' (sorted by timestamp):")
+        elif input("-- Press Enter for more or 'q' to stop --").strip().lower() == "q":
+            return
+        for row in rows:
+            prefix = f"Username: {row[0]}, " if all_users else ""
+            value, timestamp = row[-2:]
+            print(f"{prefix}{value_name}: {value}{unit}, Timestamp: {timestamp}")
+        shown += len(rows)
+    if shown == 0:
+        print(f"No {label} logs found." if all_users else f"No {label} log found for user '{username}'.")
+
+
+def show_log_summary(log_type, username, bucket, start=None, end=None):
+    """
+    *******************************
+    Function: show_log_summary
+    -------------------
+    Prints min/avg/max/count of BPM or oxygen logs per time bucket for
+    one user or all users. The aggregation is done by the database.
+
+    Input:  log_type (str) - 'bpm' or 'oxygen'
+            username (str) - Username or 'all'
+            bucket (str)   - 'minute', 'hour' or 'day'
+            start, end (datetime or None) - Optional range [start, end)
+    Output: None
+    *******************************
+    """
+    label = EXPORT_LABELS[log_type]
+    unit = "%" if log_type == 'oxygen' else ""
+    all_users = username == "all"
+    rows = get_log_summary(log_type, bucket, None if all_users else username, start, end)
+    if not rows:
+        print(f"No {label} logs found." if all_users else f"No {label} log found for user '{username}'.")
+        return
+    print(f"{label[0].upper() + label[1:]} summary per {bucket} for "
+          f"{'all users' if all_users else f'user {username!r}'}:")
+    for row in rows:
+        prefix = f"Username: {row[0]}, " if all_users else ""
+        start, low, average, high, count = row[-5:]
+        print(f"{prefix}{bucket.capitalize()}: {start}, Min: {low}{unit}, Avg: {float(average):.1f}{unit}, "
+              f"Max: {high}{unit}, Samples: {count}")
+
+
 def output_to_csv():
     """
     *******************************
     Function: output_to_csv
     -------------------
     Exports BPM and/or oxygen logs to a timestamped CSV file.
-    User can choose to export data for a specific user or all users.
+    User can choose to export data for a specific user, all users in
+    one file or each user to files of their own, and the file format:
+    CSV, gzip-compressed CSV, or typed columnar NumPy .npz / Parquet
+    files for bulk analysis. Rows are streamed from the database in
+    chunks, so memory use stays flat.
 
     Input:  None
     Output: CSV file(s) created in script directory
@@ -194,61 +363,165 @@ def output_to_csv():
             print("Invalid option. Please enter 'bpm', 'oxygen', or 'all'.")
             return
 
-        username = input("Enter the username or 'all' to export logs: ").strip().lower()
-
-        if data_type in ['bpm', 'all']:
-            if username == "all":
-                rows = get_all_bpm_logs()
-                if not rows:
-                    print("No BPM logs found.")
-                else:
-                    filename = os.path.join(script_dir, f"bpm_logs_all_users_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-                    header = ["Username", "BPM", "Timestamp"]
-                    with open(filename, mode="w", newline="", encoding="utf-8") as file:
-                        writer = csv.writer(file)
-                        writer.writerow(header)
-                        writer.writerows(rows)
-                    print(f"BPM logs successfully exported to '{filename}'.")
-            else:
-                rows = get_user_bpm_logs(username)
-                if not rows:
-                    print(f"No BPM logs found for user '{username}'.")
-                else:
-                    filename = os.path.join(script_dir, f"bpm_logs_{username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-                    header = ["BPM", "Timestamp"]
-                    with open(filename, mode="w", newline="", encoding="utf-8") as file:
-                        writer = csv.writer(file)
-                        writer.writerow(header)
-                        writer.writerows(rows)
-                    print(f"BPM logs successfully exported to '{filename}'.")
-
-        if data_type in ['oxygen', 'all']:
-            if username == "all":
-                rows = get_all_oxygen_logs()
-                if not rows:
-                    print("No oxygen level logs found.")
-                else:
-                    filename = os.path.join(script_dir, f"oxygen_logs_all_users_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-                    header = ["Username", "Oxygen Level", "Timestamp"]
-                    with open(filename, mode="w", newline="", encoding="utf-8") as file:
-                        writer = csv.writer(file)
-                        writer.writerow(header)
-                        writer.writerows(rows)
-                    print(f"Oxygen level logs successfully exported to '{filename}'.")
-            else:
-                rows = get_user_oxygen_logs(username)
-                if not rows:
-                    print(f"No oxygen level logs found for user '{username}'.")
-                else:
-                    filename = os.path.join(script_dir, f"oxygen_logs_{username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-                    header = ["Oxygen Level", "Timestamp"]
-                    with open(filename, mode="w", newline="", encoding="utf-8") as file:
-                        writer = csv.writer(file)
-                        writer.writerow(header)
-                        writer.writerows(rows)
-                    print(f"Oxygen level logs successfully exported to '{filename}'.")
+        username = input("Enter the username, 'all' for one file of all users or 'each' for a file per user: ").strip().lower()
+        if username == "each":
+            export_each_user(data_type, script_dir)
+            return
+
+        file_format = input("Enter the file format 'csv', 'csv.gz', 'npz' or 'parquet' (default: csv): ").strip().lower() or "csv"
+        if file_format not in EXPORT_FORMATS:
+            print(f"Invalid format. Please enter one of: {', '.join(EXPORT_FORMATS)}.")
+            return
+
+        time_range = prompt_time_range()
+        if time_range is None:
+            return
+
+        for log_type in ['bpm', 'oxygen']:
+            if data_type in [log_type, 'all']:
+                export_logs(log_type, username, file_format, script_dir, *time_range)
     except Exception as e:
         print(f"Error exporting logs to CSV: {e}")
 
+
+def export_logs(log_type, username, file_format, directory, start=None, end=None):
+    """
+    *******************************
+    Function: export_logs
+    -------------------
+    Streams the BPM or oxygen logs of one user, or of all users, into
+    a timestamped file in the given directory. A full export is one
+    streaming scan; a time-limited export pages through the range.
+
+    Input:  log_type (str)    - 'bpm' or 'oxygen'
+            username (str)    - Username or 'all'
+            file_format (str) - Key in EXPORT_FORMATS
+            directory (str)   - Output directory
+            start, end (datetime or None) - Optional range [start, end)
+    Output: str or None - Path of the written file
+    *******************************
+    """
+    from export import write_csv, write_npz, write_parquet
+    label = EXPORT_LABELS[log_type]
+    all_users = username == "all"
+    if start is None and end is None:
+        chunks = iter_log_chunks(log_type, None if all_users else username)
+    else:
+        chunks = iter_log_pages(log_type, None if all_users else username, start, end, EXPORT_CHUNK_SIZE)
+    first = next(chunks, None)
+    if first is None:
+        print(f"No {label} logs found." if all_users else f"No {label} logs found for user '{username}'.")
+        return None
+
+    name = "all_users" if all_users else username
+    filename = os.path.join(directory, f"{log_type}_logs_{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_format}")
+    header = [EXPORT_HEADERS[log_type], "Timestamp"]
+    if all_users:
+        header.insert(0, "Username")
+    chunks = itertools.chain([first], chunks)
+    if file_format == "npz":
+        write_npz(filename, log_type, chunks, all_users)
+    elif file_format == "parquet":
+        write_parquet(filename, log_type, chunks, all_users)
+    else:
+        write_csv(filename, header, chunks, compress=file_format == "csv.gz")
+    print(f"{label[0].upper() + label[1:]} logs successfully exported to '{filename}'.")
+    return filename
+
+
+def export_each_user(data_type, directory):
+    """
+    *******************************
+    Function: export_each_user
+    -------------------
+    Exports the logs of every user to CSV files of their own, one per
+    user (or per user and day) and log type, in a new folder. BPM and
+    oxygen files are written in the same pass over the logs, and the
+    users can be shared out among several processes.
+
+    Input:  data_type (str) - 'bpm', 'oxygen' or 'all'
+            directory (str) - Folder to create the export folder in
+    Output: None
+    *******************************
+    """
+    from export import export_per_user
+    file_format = input("Enter the file format 'csv' or 'csv.gz' (default: csv): ").strip().lower() or "csv"
+    if file_format not in ['csv', 'csv.gz']:
+        print("Invalid format. Per-user exports are written as 'csv' or 'csv.gz'.")
+        return
+    per_day = input("One file per user and day? (y/N): ").strip().lower() == 'y'
+    cores = os.cpu_count() or 1
+    try:
+        workers = int(input(f"Export with how many processes (default: {cores}): ").strip() or cores)
+    except ValueError:
+        print("Invalid number of processes.")
+        return
+    time_range = prompt_time_range()
+    if time_range is None:
+        return
+
+    users = {user_id: username for username, user_id in load_user_ids().items()}
+    headers = {log_type: header for log_type, header in EXPORT_HEADERS.items() if data_type in [log_type, 'all']}
+    folder = os.path.join(directory, f"logs_per_user_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    files, rows = export_per_user(users, headers, folder, per_day, file_format == "csv.gz", *time_range, max(1, workers))
+    if files:
+        print(f"Exported {rows} readings to {files} files in '{folder}'.")
+    else:
+        os.rmdir(folder)
+        print("No logs found.")
+
+
+def import_logs():
+    """
+    *******************************
+    Function: import_logs
+    -------------------
+    Bulk-imports readings from files into the database: CSV exports
+    (.csv, .csv.gz, as written by output_to_csv) and raw device
+    captures (any other file). Paths may contain wildcards. Prints how
+    many rows were imported and what was skipped.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    import glob
+    import time
+    from importer import import_files
+    patterns = input("Enter the files to import, separated by spaces (wildcards allowed): ").split()
+    paths = sorted({path for pattern in patterns for path in glob.glob(os.path.expanduser(pattern))
+                    if os.path.isfile(path)})
+    if not paths:
+        print("No files found.")
+        return
+    username = input("Enter the username for captures and single-user exports (default: from the file name): ").strip().lower() or None
+    create_users = input("Create users that do not exist? (y/N): ").strip().lower() == 'y'
+    try:
+        workers = int(input("Parse the files with how many processes (default: 1): ").strip() or 1)
+    except ValueError:
+        print("Invalid number of processes.")
+        return
+
+    start = time.monotonic()
+    try:
+        stats = import_files(paths, username, create_users, max(1, workers))
+    except Exception as e:
+        print(f"Error importing logs: {e}")
+        return
+    elapsed = time.monotonic() - start
+    print(f"Imported {stats['rows']} readings from {len(paths) - len(stats['failed'])} file(s) "
+          f"in {elapsed:.1f} s ({stats['rows'] / max(elapsed, 1e-9):.0f} rows/s).")
+    if stats['malformed']:
+        print(f"Skipped {stats['malformed']} malformed lines.")
+    if stats['created']:
+        print(f"Added users: {', '.join(stats['created'])}.")
+    if stats['unknown']:
+        print(f"Skipped {stats['skipped']} readings of unknown users: {', '.join(sorted(stats['unknown']))}.")
+    for path, error in stats['failed']:
+        print(f"Could not import '{path}': {error}")
+
 # ******************** Variables ************************
 current_user = {'id': None}
+EXPORT_FORMATS = ['csv', 'csv.gz', 'npz', 'parquet']
+EXPORT_LABELS = {'bpm': "BPM", 'oxygen': "oxygen level"}
+EXPORT_HEADERS = {'bpm': "BPM", 'oxygen': "Oxygen Level"}
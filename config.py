@@ -9,7 +9,8 @@
 # DESCRIPTION:  
 # A simple terminal application for collecting and exporting
 # Biometric data. This module manages configuration settings for
-# serial communication and database access.
+# serial communication and database access. COMPORT, BAUDRATE and
+# DB_CONFIG are read from their files on first access, not on import.
 #
 # *****************************************************************************
 
@@ -21,12 +22,23 @@ COMPORT_CFG = "comport.cfg"
 DEFAULT_COMPORT = "COM5"
 DEFAULT_BAUDRATE = 115200
 
+DEVICES_CFG = "devices.cfg"
+
+METRICS_CFG = "metrics.cfg"
+DEFAULT_METRICS_CONFIG = {
+    'textfile': None,       # Prometheus text file, rewritten while logging
+    'http_port': None       # Local port serving /metrics
+}
+
 DB_CFG = "db.cfg"
 DEFAULT_DB_CONFIG = {
+    'backend': "mysql",
     'host': "localhost",
     'user': "root",
     'password': "",
-    'database': ""
+    'database': "",
+    'path': "bio_metric_database.db",
+    'retention_days': 30
 }
 
 
@@ -66,6 +78,66 @@ def save_comport(comport, baudrate):
     """
     with open(COMPORT_CFG, "w") as f:
         json.dump({"comport": comport, "baudrate": baudrate}, f)
+    globals().update(COMPORT=comport, BAUDRATE=baudrate)
+
+
+def load_devices():
+    """
+    *******************************
+    Function: load_devices
+    -----------------------
+    Reads the devices.cfg file, which maps serial ports to the usernames
+    logged from them in multi-device mode, e.g. {"COM5": "alice"}.
+
+    Input:  None
+    Output: Dictionary {port: username}, empty if not configured
+    *******************************
+    """
+    if os.path.exists(DEVICES_CFG):
+        try:
+            with open(DEVICES_CFG, "r") as f:
+                data = json.load(f)
+                return {str(port): str(username) for port, username in data.items()}
+        except Exception:
+            pass
+    return {}
+
+
+def save_devices(devices):
+    """
+    *******************************
+    Function: save_devices
+    -----------------------
+    Saves the port to username mapping used in multi-device mode.
+
+    Input:  devices - Dictionary {port: username}
+    Output: None
+    *******************************
+    """
+    with open(DEVICES_CFG, "w") as f:
+        json.dump(devices, f)
+
+
+def load_metrics_config():
+    """
+    *******************************
+    Function: load_metrics_config
+    -----------------------
+    Reads the metrics.cfg file, which turns on the export of ingest
+    metrics, e.g. {"textfile": "bpm.prom", "http_port": 9105}.
+
+    Input:  None
+    Output: Dictionary with the keys of DEFAULT_METRICS_CONFIG
+    *******************************
+    """
+    if os.path.exists(METRICS_CFG):
+        try:
+            with open(METRICS_CFG, "r") as f:
+                data = json.load(f)
+                return {key: data.get(key, value) for key, value in DEFAULT_METRICS_CONFIG.items()}
+        except Exception:
+            pass
+    return DEFAULT_METRICS_CONFIG.copy()
 
 
 def load_db_config():
@@ -75,6 +147,9 @@ def load_db_config():
     -------------------------
     Loads the database configuration from the db.cfg file if it exists.
     Returns default values if the file is missing or unreadable.
+    The 'backend' key selects the storage backend ("mysql" or "sqlite");
+    'path' is the database file used by the sqlite backend and
+    'retention_days' how long raw readings are kept before compaction.
 
     Input:  None
     Output: Dictionary containing database config
@@ -85,10 +160,13 @@ def load_db_config():
             with open(DB_CFG, "r") as f:
                 data = json.load(f)
                 return {
+                    'backend': data.get('backend', DEFAULT_DB_CONFIG['backend']),
                     'host': data.get('host', DEFAULT_DB_CONFIG['host']),
                     'user': data.get('user', DEFAULT_DB_CONFIG['user']),
                     'password': data.get('password', DEFAULT_DB_CONFIG['password']),
-                    'database': data.get('database', DEFAULT_DB_CONFIG['database'])
+                    'database': data.get('database', DEFAULT_DB_CONFIG['database']),
+                    'path': data.get('path', DEFAULT_DB_CONFIG['path']),
+                    'retention_days': data.get('retention_days', DEFAULT_DB_CONFIG['retention_days'])
                 }
         except Exception:
             pass
@@ -100,16 +178,37 @@ def save_db_config(db_config):
     *******************************
     Function: save_db_config
     -------------------------
-    Saves the given database configuration dictionary to a file.
+    Saves the given database configuration dictionary to a file and
+    applies it to DB_CONFIG if that is already loaded.
 
-    Input:  db_config - Dictionary containing keys: host, user, password, database
+    Input:  db_config - Dictionary containing keys: backend, host, user,
+                        password, database, path, retention_days
     Output: None
     *******************************
     """
     with open(DB_CFG, "w") as f:
         json.dump(db_config, f)
+    if 'DB_CONFIG' in globals():
+        DB_CONFIG.update(db_config)
 
 
-# ********************** Runtime Initialization ***********************
-COMPORT, BAUDRATE = load_comport()
-DB_CONFIG = load_db_config()
+def __getattr__(name):
+    """
+    *******************************
+    Function: __getattr__
+    -------------------------
+    Loads COMPORT and BAUDRATE, or DB_CONFIG, from their configuration
+    files the first time they are accessed and keeps them as module
+    attributes, so importing config reads no files.
+
+    Input:  name (str) - Attribute name
+    Output: Value of the attribute
+    *******************************
+    """
+    if name in ('COMPORT', 'BAUDRATE'):
+        globals()['COMPORT'], globals()['BAUDRATE'] = load_comport()
+    elif name == 'DB_CONFIG':
+        globals()['DB_CONFIG'] = load_db_config()
+    else:
+        raise AttributeError(f"module 'config' has no attribute '{name}'")
+    return globals()[name]
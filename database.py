@@ -9,11 +9,105 @@
 # DESCRIPTION:  
 # A simple terminal application for collecting and exporting
 # biometric data. This module handles all interactions with
-# the MySQL database, including user and data management.
+# the database, including user and data management. The SQL is
+# shared; the storage backend (storage_mysql or storage_sqlite)
+# selected by the 'backend' key in db.cfg supplies the connection
+# and its parameter style. Nothing is loaded or connected until the
+# first query, so importing this module is cheap. Log view results
+# are cached in memory (see query_cache.py); every function writing
+# logs bumps the write version of the users it changed.
 # *****************************************************************************
 
-import mysql.connector
-from config import DB_CONFIG, save_db_config, load_db_config
+import time
+import threading
+import importlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import config
+import metrics
+import query_cache
+from config import save_db_config
+
+# ********************** Constants ************************
+BACKENDS = {
+    'mysql': "storage_mysql",
+    'sqlite': "storage_sqlite"
+}
+VITALS_COLUMNS = ("userID", "time_stamp", "bpm", "oxygen_level", "bpm_filtered", "oxygen_filtered")
+INSERT_VITALS = """
+    INSERT INTO vitals (userID, time_stamp, bpm, oxygen_level, bpm_filtered, oxygen_filtered)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+LOG_COLUMNS = {
+    'bpm': "bpm",
+    'oxygen': "oxygen_level"
+}
+SUMMARY_BUCKETS = ['minute', 'hour', 'day']
+ROLLUP_TABLES = {
+    'minute': "vitals_minute",
+    'hour': "vitals_hour"
+}
+DELETE_KEYS = {              # Log table: time column following userID in its primary key
+    'vitals': "time_stamp",
+    'vitals_minute': "bucket",
+    'vitals_hour': "bucket"
+}
+SUMMARY_ROLLUPS = {         # Rollup table each summary bucket is built from
+    'minute': "vitals_minute",
+    'hour': "vitals_hour",
+    'day': "vitals_hour"
+}
+ROLLUP_VITALS = """
+    INSERT INTO {table} (userID, bucket, bpm_min, bpm_max, bpm_sum, bpm_count,
+                         oxygen_level_min, oxygen_level_max, oxygen_level_sum, oxygen_level_count)
+    SELECT userID, {bucket},
+           MIN(bpm), MAX(bpm), COALESCE(SUM(bpm), 0), COUNT(bpm),
+           MIN(oxygen_level), MAX(oxygen_level), COALESCE(SUM(oxygen_level), 0), COUNT(oxygen_level)
+    FROM vitals
+    WHERE id >= %s AND id < %s AND time_stamp < %s
+    GROUP BY 1, 2
+"""
+LOG_PAGE_SIZE = 50          # Rows per page in the interactive log views
+EXPORT_CHUNK_SIZE = 10000   # Rows per fetchmany when streaming logs
+COMPACT_CHUNK_SIZE = 5000   # Raw rows per compaction transaction
+DELETE_CHUNK_SIZE = 5000    # Rows per delete_logs transaction
+POOL_SIZE = 8               # Most connections open at the same time
+POOL_TIMEOUT = 30.0         # Seconds to wait for a free connection
+HEALTH_CHECK_INTERVAL = 30.0  # Idle seconds after which a connection is pinged
+
+
+def load_backend(name):
+    """
+    *******************************
+    Function: load_backend
+    -------------------
+    Imports the storage backend module registered under the given name.
+
+    Input:  name (str) - Key in BACKENDS, e.g. "mysql" or "sqlite"
+    Output: module - Backend module
+    *******************************
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    return importlib.import_module(BACKENDS[name])
+
+
+def get_backend():
+    """
+    *******************************
+    Function: get_backend
+    -------------------
+    Returns the storage backend selected in the database config,
+    importing it on first use.
+
+    Input:  None
+    Output: module - Backend module
+    *******************************
+    """
+    global backend
+    if backend is None:
+        backend = load_backend(config.DB_CONFIG['backend'])
+    return backend
 
 
 def prompt_db_config():
@@ -32,35 +126,157 @@ def prompt_db_config():
     user = input("User (default: root): ").strip() or "root"
     password = input("Password: ").strip()
     database = input("Database name (default: bio_metric_database): ").strip() or "bio_metric_database"
-    db_config = {
-        'host': host,
-        'user': user,
-        'password': password,
-        'database': database
-    }
+    db_config = dict(
+        config.DB_CONFIG,
+        backend=backend.NAME,
+        host=host,
+        user=user,
+        password=password,
+        database=database
+    )
     save_db_config(db_config)
     return db_config
 
 
-def connect_db():
+def connect_db(prompt=True):
     """
     *******************************
     Function: connect_db
     -------------------
-    Attempts to connect to the MySQL database using config from file.
-    If connection fails, prompts user for updated settings.
+    Attempts to connect to the configured database backend using config
+    from file. If a MySQL connection fails, prompts user for updated
+    settings; other backends re-raise the error. Background threads
+    pass prompt=False to get the error silently instead, as does every
+    caller after disable_prompts().
 
-    Input:  None
-    Output: mysql.connector.MySQLConnection
+    Input:  prompt (bool) - Report failures and ask for new settings
+    Output: DB-API connection of the selected backend
     *******************************
     """
-    config = DB_CONFIG
+    db_config = config.DB_CONFIG
     while True:
         try:
-            return mysql.connector.connect(**config)
-        except mysql.connector.Error as e:
+            return backend.connect(db_config)
+        except backend.Error as e:
+            if not prompt or not _prompts_enabled:
+                raise
             print(f"Error connecting to database: {e}")
-            config = prompt_db_config()
+            if not backend.PROMPT_ON_FAILURE:
+                raise
+            db_config = prompt_db_config()
+
+
+def disable_prompts():
+    """
+    *******************************
+    Function: disable_prompts
+    -------------------
+    Makes connection failures raise instead of asking for new settings,
+    for runs without a terminal such as the batch CLI.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    global _prompts_enabled
+    _prompts_enabled = False
+
+
+@contextmanager
+def connection(exclusive=False, prompt=True):
+    """
+    *******************************
+    Function: connection
+    -------------------
+    Checks a connection out of the pool for the duration of a with
+    block and returns it afterwards. Nested blocks in the same thread
+    share the connection they already hold, unless exclusive is set
+    (for generators that keep a result set open between yields). A
+    connection that sat idle longer than HEALTH_CHECK_INTERVAL is
+    pinged first and replaced if it is dead; one whose block raised is
+    rolled back, or discarded if even that fails. At most POOL_SIZE
+    connections exist at once.
+
+    Input:  exclusive (bool) - Use a connection of its own
+            prompt (bool)    - Passed to connect_db for a new connection
+    Output: context manager yielding a DB-API connection
+    *******************************
+    """
+    conn = None if exclusive else getattr(_local, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+
+    get_backend()
+    if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+        raise RuntimeError(f"No database connection free after {POOL_TIMEOUT:.0f} seconds (pool exhausted).")
+    try:
+        with _pool_lock:
+            conn, last_used = _idle.pop() if _idle else (None, None)
+        if conn is not None and time.monotonic() - last_used > HEALTH_CHECK_INTERVAL and not backend.ping(conn):
+            _close_quietly(conn)
+            conn = None
+        if conn is None:
+            conn = connect_db(prompt)
+    except BaseException:
+        _pool_slots.release()
+        raise
+
+    if not exclusive:
+        _local.conn = conn
+    try:
+        yield conn
+    except BaseException:
+        try:
+            conn.rollback()
+        except backend.Error:
+            _close_quietly(conn)
+            conn = None
+        raise
+    finally:
+        if not exclusive:
+            _local.conn = None
+        if conn is not None:
+            with _pool_lock:
+                _idle.append((conn, time.monotonic()))
+        _pool_slots.release()
+
+
+def close_pool():
+    """
+    *******************************
+    Function: close_pool
+    -------------------
+    Closes every idle pooled connection, e.g. before the program exits.
+    Connections that are checked out are returned to the pool as usual.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    with _pool_lock:
+        idle = _idle[:]
+        _idle.clear()
+    for conn, _ in idle:
+        _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    """
+    *******************************
+    Function: _close_quietly
+    -------------------
+    Closes a connection that is being dropped from the pool, ignoring
+    errors from a connection that is already broken.
+
+    Input:  conn (DB-API connection)
+    Output: None
+    *******************************
+    """
+    try:
+        conn.close()
+    except backend.Error:
+        pass
 
 
 def add_user(username, age):
@@ -74,11 +290,13 @@ def add_user(username, age):
     Output: None
     *******************************
     """
-    cursor = conn.cursor()
-    query = "INSERT INTO user (username, age) VALUES (%s, %s)"
-    cursor.execute(query, (username, age))
-    conn.commit()
-    cursor.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        query = "INSERT INTO user (username, age) VALUES (%s, %s)"
+        cursor.execute(backend.prepare(query), (username, age))
+        conn.commit()
+        cursor.close()
+    invalidate_user_cache(username)
 
 
 def remove_user(username):
@@ -92,11 +310,16 @@ def remove_user(username):
     Output: None
     *******************************
     """
-    cursor = conn.cursor()
-    query = "DELETE FROM user WHERE username = %s"
-    cursor.execute(query, (username,))
-    conn.commit()
-    cursor.close()
+    user_id = get_user_id(username)
+    with connection() as conn:
+        cursor = conn.cursor()
+        query = "DELETE FROM user WHERE username = %s"
+        cursor.execute(backend.prepare(query), (username,))
+        conn.commit()
+        cursor.close()
+    invalidate_user_cache(username)
+    if user_id:
+        query_cache.bump([user_id])
 
 
 def get_user_id(username):
@@ -104,18 +327,89 @@ def get_user_id(username):
     *******************************
     Function: get_user_id
     -------------------
-    Retrieves a user’s ID based on their username.
+    Retrieves a user’s ID based on their username. Found IDs are kept
+    in an in-process cache (usernames compare case-insensitively, as in
+    the database), so repeated lookups skip the round trip.
+    add_user and remove_user invalidate the cached entry.
 
     Input:  username (str)
     Output: int or None - User ID
     *******************************
     """
-    cursor = conn.cursor()
-    query = "SELECT id FROM user WHERE username = %s"
-    cursor.execute(query, (username,))
-    result = cursor.fetchone()
-    cursor.close()
-    return result[0] if result else None
+    key = username.lower()
+    user_id = _user_ids.get(key)
+    if user_id is not None:
+        return user_id
+    with connection() as conn:
+        cursor = conn.cursor()
+        query = "SELECT id FROM user WHERE username = %s"
+        cursor.execute(backend.prepare(query), (username,))
+        result = cursor.fetchone()
+        cursor.close()
+    if not result:
+        return None
+    _user_ids[key] = result[0]
+    return result[0]
+
+
+def load_user_ids():
+    """
+    *******************************
+    Function: load_user_ids
+    -------------------
+    Reads every username and ID in one query and fills the user ID
+    cache with them, for bulk work that resolves many usernames.
+
+    Input:  None
+    Output: dict - {lower-case username: user ID}
+    *******************************
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(backend.prepare("SELECT username, id FROM user"))
+        user_ids = {username.lower(): user_id for username, user_id in cursor.fetchall()}
+        cursor.close()
+    _user_ids.update(user_ids)
+    return user_ids
+
+
+def invalidate_user_cache(username=None):
+    """
+    *******************************
+    Function: invalidate_user_cache
+    -------------------
+    Drops one username, or every username, from the user ID cache.
+    Call it after changing users outside this process.
+
+    Input:  username (str or None) - None clears the whole cache
+    Output: None
+    *******************************
+    """
+    if username is None:
+        _user_ids.clear()
+    else:
+        _user_ids.pop(username.lower(), None)
+
+
+def log_vitals(user_id, bpm, oxygen_level, timestamp):
+    """
+    *******************************
+    Function: log_vitals
+    -------------------
+    Logs one reading for a user into the vitals table. Either value
+    may be None when the device only reported the other one.
+
+    Input:  user_id (int), bpm (int or None), oxygen_level (int or None),
+            timestamp (datetime)
+    Output: None
+    *******************************
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(backend.prepare(INSERT_VITALS), (user_id, timestamp, bpm, oxygen_level, None, None))
+        conn.commit()
+        cursor.close()
+    query_cache.bump([user_id])
 
 
 def log_bpm(user_id, bpm, timestamp):
@@ -123,17 +417,13 @@ def log_bpm(user_id, bpm, timestamp):
     *******************************
     Function: log_bpm
     -------------------
-    Logs a BPM value for a user into the bpm_table.
+    Logs a BPM value for a user into the vitals table.
 
     Input:  user_id (int), bpm (int), timestamp (datetime)
     Output: None
     *******************************
     """
-    cursor = conn.cursor()
-    query = "INSERT INTO bpm_table (userID, bpm, time_stamp) VALUES (%s, %s, %s)"
-    cursor.execute(query, (user_id, bpm, timestamp))
-    conn.commit()
-    cursor.close()
+    log_vitals(user_id, bpm, None, timestamp)
 
 
 def log_oxygen_level(user_id, oxygen_level, timestamp):
@@ -141,17 +431,101 @@ def log_oxygen_level(user_id, oxygen_level, timestamp):
     *******************************
     Function: log_oxygen_level
     -------------------
-    Logs an oxygen level for a user into the oxygen_level_table.
+    Logs an oxygen level for a user into the vitals table.
 
     Input:  user_id (int), oxygen_level (int), timestamp (datetime)
     Output: None
     *******************************
     """
-    cursor = conn.cursor()
-    query = "INSERT INTO oxygen_level_table (userID, oxygen_level, time_stamp) VALUES (%s, %s, %s)"
-    cursor.execute(query, (user_id, oxygen_level, timestamp))
-    conn.commit()
-    cursor.close()
+    log_vitals(user_id, None, oxygen_level, timestamp)
+
+
+def bulk_insert_vitals(rows):
+    """
+    *******************************
+    Function: bulk_insert_vitals
+    -------------------
+    Writes a large batch of readings in one transaction with the
+    backend's fastest bulk path (LOAD DATA LOCAL INFILE on MySQL).
+    Flush listeners are not called.
+
+    Input:  rows (list of tuples) - (user_id, timestamp, bpm, oxygen_level,
+                                     bpm_filtered, oxygen_filtered)
+    Output: int - Number of rows written
+    *******************************
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            backend.bulk_insert(cursor, "vitals", VITALS_COLUMNS, rows)
+            conn.commit()
+        finally:
+            cursor.close()
+    query_cache.bump({row[0] for row in rows})
+    return len(rows)
+
+
+def insert_vitals(rows, prompt=True):
+    """
+    *******************************
+    Function: insert_vitals
+    -------------------
+    Writes readings with executemany and a single commit, timing both
+    (see metrics.py), then passes them to the flush listeners.
+
+    Input:  rows (list of tuples) - (user_id, timestamp, bpm, oxygen_level,
+                                     bpm_filtered, oxygen_filtered)
+            prompt (bool) - Ask for new settings if connecting fails
+    Output: int - Number of rows written
+    *******************************
+    """
+    with connection(prompt=prompt) as conn:
+        cursor = conn.cursor()
+        try:
+            started = time.perf_counter()
+            cursor.executemany(backend.prepare(INSERT_VITALS), rows)
+            written = time.perf_counter()
+            conn.commit()
+            metrics.observe('db_write', written - started)
+            metrics.observe('db_commit', time.perf_counter() - written)
+        finally:
+            cursor.close()
+    metrics.inc('rows_committed', len(rows))
+    query_cache.bump({row[0] for row in rows})
+    for listener in _flush_listeners:
+        listener(rows)
+    return len(rows)
+
+
+def add_flush_listener(listener):
+    """
+    *******************************
+    Function: add_flush_listener
+    -------------------
+    Registers a callback that receives the rows of every commit of
+    insert_vitals, e.g. to measure end-to-end ingest latency.
+
+    Input:  listener (callable) - listener(rows), rows being a list of
+                                  (user_id, timestamp, bpm, oxygen_level,
+                                   bpm_filtered, oxygen_filtered)
+    Output: None
+    *******************************
+    """
+    _flush_listeners.append(listener)
+
+
+def remove_flush_listener(listener):
+    """
+    *******************************
+    Function: remove_flush_listener
+    -------------------
+    Unregisters a callback added with add_flush_listener.
+
+    Input:  listener (callable)
+    Output: None
+    *******************************
+    """
+    _flush_listeners.remove(listener)
 
 
 def get_all_bpm_logs():
@@ -165,17 +539,14 @@ def get_all_bpm_logs():
     Output: list of tuples (username, bpm, timestamp)
     *******************************
     """
-    cursor = conn.cursor()
     query = """
-        SELECT user.username, bpm_table.bpm, bpm_table.time_stamp 
-        FROM bpm_table 
-        INNER JOIN user ON bpm_table.userID = user.id
-        ORDER BY user.username, bpm_table.time_stamp
+        SELECT user.username, vitals.bpm, vitals.time_stamp
+        FROM user
+        INNER JOIN vitals ON vitals.userID = user.id
+        WHERE vitals.bpm IS NOT NULL
+        ORDER BY user.username, vitals.time_stamp
     """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    cursor.close()
-    return rows
+    return _fetch_cached(None, query)
 
 
 def get_user_bpm_logs(username):
@@ -183,24 +554,24 @@ def get_user_bpm_logs(username):
     *******************************
     Function: get_user_bpm_logs
     -------------------
-    Retrieves BPM logs for a specific user.
+    Retrieves BPM logs for a specific user. The user id comes from the
+    user cache, so the rows come from a range scan of the
+    (userID, time_stamp) index in timestamp order, without a join.
 
     Input:  username (str)
     Output: list of tuples (bpm, timestamp)
     *******************************
     """
-    cursor = conn.cursor()
+    user_id = get_user_id(username)
+    if not user_id:
+        return []
     query = """
-        SELECT bpm_table.bpm, bpm_table.time_stamp 
-        FROM bpm_table 
-        INNER JOIN user ON bpm_table.userID = user.id 
-        WHERE user.username = %s
-        ORDER BY bpm_table.time_stamp
+        SELECT bpm, time_stamp
+        FROM vitals
+        WHERE userID = %s AND bpm IS NOT NULL
+        ORDER BY time_stamp
     """
-    cursor.execute(query, (username,))
-    rows = cursor.fetchall()
-    cursor.close()
-    return rows
+    return _fetch_cached(user_id, query, (user_id,))
 
 
 def get_all_oxygen_logs():
@@ -214,17 +585,14 @@ def get_all_oxygen_logs():
     Output: list of tuples (username, oxygen_level, timestamp)
     *******************************
     """
-    cursor = conn.cursor()
     query = """
-        SELECT user.username, oxygen_level_table.oxygen_level, oxygen_level_table.time_stamp 
-        FROM oxygen_level_table 
-        INNER JOIN user ON oxygen_level_table.userID = user.id
-        ORDER BY user.username, oxygen_level_table.time_stamp
+        SELECT user.username, vitals.oxygen_level, vitals.time_stamp
+        FROM user
+        INNER JOIN vitals ON vitals.userID = user.id
+        WHERE vitals.oxygen_level IS NOT NULL
+        ORDER BY user.username, vitals.time_stamp
     """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    cursor.close()
-    return rows
+    return _fetch_cached(None, query)
 
 
 def get_user_oxygen_logs(username):
@@ -232,47 +600,492 @@ def get_user_oxygen_logs(username):
     *******************************
     Function: get_user_oxygen_logs
     -------------------
-    Retrieves oxygen level logs for a specific user.
+    Retrieves oxygen level logs for a specific user. The user id comes
+    from the user cache, so the rows come from a range scan of the
+    (userID, time_stamp) index in timestamp order, without a join.
 
     Input:  username (str)
     Output: list of tuples (oxygen_level, timestamp)
     *******************************
     """
-    cursor = conn.cursor()
+    user_id = get_user_id(username)
+    if not user_id:
+        return []
     query = """
-        SELECT oxygen_level_table.oxygen_level, oxygen_level_table.time_stamp 
-        FROM oxygen_level_table 
-        INNER JOIN user ON oxygen_level_table.userID = user.id 
-        WHERE user.username = %s
-        ORDER BY oxygen_level_table.time_stamp
+        SELECT oxygen_level, time_stamp
+        FROM vitals
+        WHERE userID = %s AND oxygen_level IS NOT NULL
+        ORDER BY time_stamp
+    """
+    return _fetch_cached(user_id, query, (user_id,))
+
+
+def _fetch_cached(user_id, query, params=()):
+    """
+    *******************************
+    Function: _fetch_cached
+    -------------------
+    Runs a log query, or serves its result from the query cache while
+    the logs it reads are unchanged. The result is keyed by the query
+    and its parameters (user, range, page).
+
+    Input:  user_id (int or None) - User the result depends on, None
+                                    for a result about all users
+            query (str), params (tuple)
+    Output: list of tuples - A copy, so callers may change it
+    *******************************
+    """
+    key = (query, params)
+    current = query_cache.version(user_id)
+    rows = query_cache.get(key, current)
+    if rows is None:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(backend.prepare(query), params)
+            rows = cursor.fetchall()
+            cursor.close()
+        query_cache.put(key, current, rows, query_cache.estimate_size(rows))
+    return list(rows)
+
+
+def get_log_summary(data_type, bucket, username=None, start=None, end=None):
+    """
+    *******************************
+    Function: get_log_summary
+    -------------------
+    Summarizes BPM or oxygen logs per minute, hour or day. Grouping
+    and aggregation run in the database, so only one row per bucket
+    is transferred. Readings already compacted into the rollup tables
+    are included, so old ranges are served from the rollups; there the
+    range is applied to whole rollup buckets. Repeated summaries of
+    unchanged logs come from the query cache.
+
+    Input:  data_type (str) - 'bpm' or 'oxygen'
+            bucket (str)    - One of SUMMARY_BUCKETS
+            username (str or None) - One user, or None for all users
+            start, end (datetime or None) - Optional range [start, end)
+    Output: list of tuples
+            (username, bucket_start, min, avg, max, count) for all users,
+            (bucket_start, min, avg, max, count) for one user
+    *******************************
+    """
+    column = LOG_COLUMNS[data_type]
+    if bucket not in SUMMARY_BUCKETS:
+        raise ValueError(f"Unknown summary bucket '{bucket}'. Choose one of: {', '.join(SUMMARY_BUCKETS)}")
+    get_backend()
+    raw_range, raw_params = _time_range('time_stamp', start, end)
+    rollup_range, rollup_params = _time_range('bucket', start, end)
+    if username is None:
+        user_id = None
+        user_sql = ""
+        user_params = ()
+    else:
+        user_id = get_user_id(username)
+        if not user_id:
+            return []
+        user_sql = " AND userID = %s"
+        user_params = (user_id,)
+    parts = f"""
+        SELECT userID, {backend.truncate_time('time_stamp', bucket)} AS part_bucket,
+               MIN({column}) AS low, SUM({column}) AS total, COUNT({column}) AS n, MAX({column}) AS high
+        FROM vitals
+        WHERE {column} IS NOT NULL{user_sql}{raw_range}
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT userID, {backend.truncate_time('bucket', bucket)},
+               MIN({column}_min), SUM({column}_sum), SUM({column}_count), MAX({column}_max)
+        FROM {SUMMARY_ROLLUPS[bucket]}
+        WHERE {column}_count > 0{user_sql}{rollup_range}
+        GROUP BY 1, 2
+    """
+    aggregates = "MIN(parts.low), SUM(parts.total) * 1.0 / SUM(parts.n), MAX(parts.high), SUM(parts.n)"
+    if username is None:
+        query = f"""
+            SELECT user.username, {backend.time_bucket('parts.part_bucket', bucket)}, {aggregates}
+            FROM ({parts}) AS parts
+            INNER JOIN user ON user.id = parts.userID
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        """
+    else:
+        query = f"""
+            SELECT {backend.time_bucket('parts.part_bucket', bucket)}, {aggregates}
+            FROM ({parts}) AS parts
+            GROUP BY 1
+            ORDER BY 1
+        """
+    params = user_params + raw_params + user_params + rollup_params
+    return _fetch_cached(user_id, query, params)
+
+
+def compact(retention_days=None, chunk_size=COMPACT_CHUNK_SIZE, progress=None):
+    """
+    *******************************
+    Function: compact
+    -------------------
+    Rolls raw readings older than the retention window into the
+    per-minute and per-hour rollup tables and purges them from vitals.
+    Works through id ranges of chunk_size rows, each rolled up and
+    deleted in its own short transaction, so locks are never held for
+    long and an interrupted run loses nothing; running it again picks
+    up where it stopped. The cutoff is rounded down to a full hour.
+
+    Input:  retention_days (float or None) - Days of raw readings to
+                keep, default 'retention_days' from db.cfg
+            chunk_size (int)
+            progress (callable or None) - progress(purged, fraction)
+                after every chunk
+    Output: int - Number of raw readings compacted
+    *******************************
+    """
+    if retention_days is None:
+        retention_days = config.DB_CONFIG['retention_days']
+    cutoff = (datetime.now() - timedelta(days=retention_days)).replace(minute=0, second=0, microsecond=0)
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(backend.prepare("SELECT MIN(id), MAX(id) FROM vitals WHERE time_stamp < %s"), (cutoff,))
+        low, high = cursor.fetchone()
+        cursor.close()
+    if low is None:
+        return 0
+
+    purged = 0
+    try:
+        for first in range(low, high + 1, chunk_size):
+            params = (first, min(first + chunk_size, high + 1), cutoff)
+            with connection() as conn:
+                cursor = conn.cursor()
+                for bucket, table in ROLLUP_TABLES.items():
+                    cursor.execute(backend.prepare(ROLLUP_VITALS.format(
+                        table=table, bucket=backend.truncate_time('time_stamp', bucket))), params)
+                cursor.execute(backend.prepare(
+                    "DELETE FROM vitals WHERE id >= %s AND id < %s AND time_stamp < %s"), params)
+                purged += cursor.rowcount
+                conn.commit()
+                cursor.close()
+            if progress is not None:
+                progress(purged, (params[1] - low) / (high + 1 - low))
+    finally:
+        if purged:
+            query_cache.clear()
+    return purged
+
+
+def _time_range(column, start, end):
+    """
+    *******************************
+    Function: _time_range
+    -------------------
+    Builds the optional [start, end) filter on a timestamp column.
+
+    Input:  column (str), start (datetime or None), end (datetime or None)
+    Output: Tuple (sql, params) - sql starts with " AND" or is empty
+    *******************************
+    """
+    sql = ""
+    params = ()
+    if start is not None:
+        sql += f" AND {column} >= %s"
+        params += (start,)
+    if end is not None:
+        sql += f" AND {column} < %s"
+        params += (end,)
+    return sql, params
+
+
+def get_log_page(data_type, user_id, start=None, end=None, after=None, page_size=LOG_PAGE_SIZE):
+    """
+    *******************************
+    Function: get_log_page
+    -------------------
+    Retrieves one page of a user's BPM or oxygen logs in timestamp
+    order, optionally limited to [start, end). Uses keyset pagination:
+    the page seeks past the (time_stamp, id) key of the previous page
+    in the (userID, time_stamp, id) index, so every page costs the same
+    however deep into the history it is. Pages of unchanged logs come
+    from the query cache.
+
+    Input:  data_type (str) - 'bpm' or 'oxygen'
+            user_id (int)
+            start, end (datetime or None) - Optional range [start, end)
+            after (tuple or None) - Key returned with the previous page
+            page_size (int)
+    Output: Tuple (rows, after) - rows is a list of (value, timestamp);
+            after is the key for the next page, None on the last page
+    *******************************
+    """
+    column = LOG_COLUMNS[data_type]
+    range_sql, params = _time_range('time_stamp', start, end)
+    seek_sql = ""
+    if after is not None:
+        seek_sql = " AND (time_stamp > %s OR (time_stamp = %s AND id > %s))"
+        params += (after[0], after[0], after[1])
+    query = f"""
+        SELECT {column}, time_stamp, id
+        FROM vitals
+        WHERE userID = %s AND {column} IS NOT NULL{range_sql}{seek_sql}
+        ORDER BY time_stamp, id
+        LIMIT %s
+    """
+    rows = _fetch_cached(user_id, query, (user_id,) + params + (page_size,))
+    if len(rows) < page_size:
+        after = None
+    else:
+        after = (rows[-1][1], rows[-1][2])
+    return [(value, timestamp) for value, timestamp, _ in rows], after
+
+
+def iter_log_pages(data_type, username=None, start=None, end=None, page_size=LOG_PAGE_SIZE):
+    """
+    *******************************
+    Function: iter_log_pages
+    -------------------
+    Lazily pages through the BPM or oxygen logs of one user, or of all
+    users in username order, optionally limited to [start, end).
+    Each page is fetched with get_log_page only when it is requested.
+
+    Input:  data_type (str) - 'bpm' or 'oxygen'
+            username (str or None) - One user, or None for all users
+            start, end (datetime or None) - Optional range [start, end)
+            page_size (int)
+    Output: generator of lists of tuples
+            (username, value, timestamp) for all users,
+            (value, timestamp) for one user
+    *******************************
+    """
+    if username is None:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(backend.prepare("SELECT id, username FROM user ORDER BY username"))
+            users = cursor.fetchall()
+            cursor.close()
+    else:
+        user_id = get_user_id(username)
+        users = [(user_id, None)] if user_id else []
+
+    for user_id, name in users:
+        after = None
+        while True:
+            rows, after = get_log_page(data_type, user_id, start, end, after, page_size)
+            if rows:
+                yield rows if name is None else [(name,) + row for row in rows]
+            if after is None:
+                break
+
+
+def iter_log_chunks(data_type, username=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    *******************************
+    Function: iter_log_chunks
+    -------------------
+    Streams BPM or oxygen logs in chunks of at most chunk_size rows.
+    Holds a pooled connection of its own with an unbuffered cursor
+    until the generator is exhausted or closed, so memory use does not
+    depend on the size of the table and other queries are not blocked.
+    Results small enough for the query cache are kept once read to the
+    end, and served from it while the logs are unchanged.
+
+    Input:  data_type (str)  - 'bpm' or 'oxygen'
+            username (str or None) - One user, or None for all users
+            chunk_size (int) - Rows per fetchmany
+    Output: generator of lists of tuples
+            (username, value, timestamp) for all users,
+            (value, timestamp) for one user
+    *******************************
+    """
+    column = LOG_COLUMNS[data_type]
+    if username is None:
+        user_id = None
+        query = f"""
+            SELECT user.username, vitals.{column}, vitals.time_stamp
+            FROM user
+            INNER JOIN vitals ON vitals.userID = user.id
+            WHERE vitals.{column} IS NOT NULL
+            ORDER BY user.username, vitals.time_stamp
+        """
+        params = ()
+    else:
+        user_id = get_user_id(username)
+        if not user_id:
+            return
+        query = f"""
+            SELECT {column}, time_stamp
+            FROM vitals
+            WHERE userID = %s AND {column} IS NOT NULL
+            ORDER BY time_stamp
+        """
+        params = (user_id,)
+    key = (query, params, chunk_size)
+    current = query_cache.version(user_id)
+    chunks = query_cache.get(key, current)
+    if chunks is not None:
+        for rows in chunks:
+            yield list(rows)
+        return
+
+    chunks = []
+    size = 0
+    with connection(exclusive=True) as conn:
+        cursor = backend.stream_cursor(conn)
+        cursor.execute(backend.prepare(query), params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if chunks is not None:
+                size += query_cache.estimate_size(rows)
+                if size <= query_cache.ENTRY_BYTES:
+                    chunks.append(list(rows))
+                else:
+                    chunks = None
+            yield rows
+        cursor.close()
+    if chunks is not None:
+        query_cache.put(key, current, chunks, size)
+
+
+def iter_vitals_chunks(user_ids, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE, prompt=True):
+    """
+    *******************************
+    Function: iter_vitals_chunks
+    -------------------
+    Streams the readings of several users, both vitals per row, in one
+    scan ordered by user and time: the order of the (userID, time_stamp,
+    id) key, so the database reads the index front to back and never
+    sorts. Holds a pooled connection of its own like iter_log_chunks.
+
+    Input:  user_ids (list of int)
+            start, end (datetime or None) - Optional range [start, end)
+            chunk_size (int) - Rows per fetchmany
+            prompt (bool)    - Passed to connect_db for a new connection
+    Output: generator of lists of tuples
+            (user_id, timestamp, bpm, oxygen_level)
+    *******************************
+    """
+    if not user_ids:
+        return
+    range_sql, params = _time_range('time_stamp', start, end)
+    query = f"""
+        SELECT userID, time_stamp, bpm, oxygen_level
+        FROM vitals
+        WHERE userID IN ({', '.join(['%s'] * len(user_ids))}){range_sql}
+        ORDER BY userID, time_stamp, id
     """
-    cursor.execute(query, (username,))
-    rows = cursor.fetchall()
-    cursor.close()
-    return rows
+    with connection(exclusive=True, prompt=prompt) as conn:
+        cursor = backend.stream_cursor(conn)
+        cursor.execute(backend.prepare(query), tuple(user_ids) + params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
 
 
-def delete_logs(user_id=None):
+def delete_logs(user_id=None, chunk_size=DELETE_CHUNK_SIZE, progress=None, fast=True):
     """
     *******************************
     Function: delete_logs
     -------------------
-    Deletes all logs, or logs for a specific user, from the database.
+    Deletes all logs, or logs for a specific user, from the database,
+    including their rollups. Wiping all logs empties the tables in one
+    step (TRUNCATE on MySQL) unless fast is False. Otherwise rows are
+    deleted per user in primary key order, chunk_size rows per
+    transaction, so ingest keeps running alongside. An interrupted
+    run is resumed by calling it again.
 
     Input:  user_id (int or None)
-    Output: None
+            chunk_size (int) - Rows per delete transaction
+            progress (callable or None) - progress(deleted, total)
+                after every chunk
+            fast (bool) - Truncate when wiping all logs
+    Output: int or None - Rows deleted, None after a truncate
     *******************************
     """
-    cursor = conn.cursor()
+    if user_id is None and fast:
+        with connection() as conn:
+            cursor = conn.cursor()
+            for table in DELETE_KEYS:
+                cursor.execute(backend.truncate_table(table))
+            conn.commit()
+            cursor.close()
+        query_cache.clear()
+        return None
+
     if user_id is None:
-        cursor.execute("DELETE FROM bpm_table")
-        cursor.execute("DELETE FROM oxygen_level_table")
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(backend.prepare("SELECT id FROM user ORDER BY id"))
+            user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
     else:
-        cursor.execute("DELETE FROM bpm_table WHERE userID = %s", (user_id,))
-        cursor.execute("DELETE FROM oxygen_level_table WHERE userID = %s", (user_id,))
-    conn.commit()
-    cursor.close()
+        user_ids = [user_id]
+    with connection() as conn:
+        cursor = conn.cursor()
+        total = 0
+        for table in DELETE_KEYS:
+            for uid in user_ids:
+                cursor.execute(backend.prepare(f"SELECT COUNT(*) FROM {table} WHERE userID = %s"), (uid,))
+                total += cursor.fetchone()[0]
+        cursor.close()
+
+    deleted = 0
+    try:
+        for table, key in DELETE_KEYS.items():
+            for uid in user_ids:
+                while True:
+                    count, done = _delete_chunk(table, key, uid, chunk_size)
+                    deleted += count
+                    if progress is not None and count:
+                        progress(deleted, total)
+                    if done:
+                        break
+    finally:
+        query_cache.bump(user_ids)
+    return deleted
+
+
+def _delete_chunk(table, key, user_id, chunk_size):
+    """
+    *******************************
+    Function: _delete_chunk
+    -------------------
+    Deletes the oldest chunk_size rows of one user from a log table in
+    one transaction. The chunk is the key range up to the key of the
+    chunk_size-th row, a range of the primary key, so only those rows
+    are locked. Rows sharing the boundary key go with the chunk.
+
+    Input:  table (str), key (str) - Time column after userID in the
+                                     primary key
+            user_id (int), chunk_size (int)
+    Output: Tuple (deleted, done) - done is True once the user has
+            no rows left in the table
+    *******************************
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(backend.prepare(
+            f"SELECT {key} FROM {table} WHERE userID = %s ORDER BY {key} LIMIT 1 OFFSET %s"
+        ), (user_id, chunk_size - 1))
+        boundary = cursor.fetchone()
+        if boundary is None:
+            cursor.execute(backend.prepare(f"DELETE FROM {table} WHERE userID = %s"), (user_id,))
+        else:
+            cursor.execute(backend.prepare(
+                f"DELETE FROM {table} WHERE userID = %s AND {key} <= %s"
+            ), (user_id, boundary[0]))
+        deleted = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return deleted, boundary is None
 
 
-# ******************** Runtime Initialization ********************
-conn = connect_db()
+# ******************** Variables ************************
+_flush_listeners = []
+_user_ids = {}              # Lower-case username -> user ID
+_idle = []                  # (connection, time.monotonic() when returned)
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_SIZE)
+_local = threading.local()  # Connection checked out by the current thread
+backend = None              # Storage backend module, see get_backend()
+_prompts_enabled = True     # See disable_prompts()
@@ -8,18 +8,60 @@ CREATE TABLE IF NOT EXISTS `user` (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE TABLE bpm_table (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+-- One row per reading. A line carrying both values is stored once;
+-- a line with only one of them leaves the other column NULL.
+-- The *_filtered columns hold the moving average from the live
+-- analytics stage, NULL where a reading was rejected as an artifact
+-- or was not logged through it.
+-- The primary key clusters each user's readings by time so history
+-- queries are index range scans.
+CREATE TABLE IF NOT EXISTS vitals (
+    id BIGINT NOT NULL AUTO_INCREMENT,
     userID INT NOT NULL,
-    bpm INT NOT NULL,
-    time_stamp TIME NOT NULL,
+    time_stamp DATETIME(3) NOT NULL,
+    bpm SMALLINT UNSIGNED NULL,
+    oxygen_level TINYINT UNSIGNED NULL,
+    bpm_filtered SMALLINT UNSIGNED NULL,
+    oxygen_filtered TINYINT UNSIGNED NULL,
+    PRIMARY KEY (userID, time_stamp, id),
+    KEY idx_vitals_id (id),
     FOREIGN KEY (userID) REFERENCES user(id)
 );
 
-CREATE TABLE oxygen_level_table (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+-- Per-minute and per-hour rollups of readings moved out of vitals by
+-- compaction (database.compact). A bucket may have several rows, one
+-- per compaction chunk; queries add them up. Re-running this script
+-- on an existing database adds these tables.
+CREATE TABLE IF NOT EXISTS vitals_minute (
+    id BIGINT NOT NULL AUTO_INCREMENT,
     userID INT NOT NULL,
-    oxygen_level INT NOT NULL,
-    time_stamp TIME NOT NULL,
+    bucket DATETIME NOT NULL,
+    bpm_min SMALLINT UNSIGNED NULL,
+    bpm_max SMALLINT UNSIGNED NULL,
+    bpm_sum BIGINT UNSIGNED NOT NULL,
+    bpm_count INT UNSIGNED NOT NULL,
+    oxygen_level_min TINYINT UNSIGNED NULL,
+    oxygen_level_max TINYINT UNSIGNED NULL,
+    oxygen_level_sum BIGINT UNSIGNED NOT NULL,
+    oxygen_level_count INT UNSIGNED NOT NULL,
+    PRIMARY KEY (userID, bucket, id),
+    KEY idx_vitals_minute_id (id),
     FOREIGN KEY (userID) REFERENCES user(id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS vitals_hour (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    userID INT NOT NULL,
+    bucket DATETIME NOT NULL,
+    bpm_min SMALLINT UNSIGNED NULL,
+    bpm_max SMALLINT UNSIGNED NULL,
+    bpm_sum BIGINT UNSIGNED NOT NULL,
+    bpm_count INT UNSIGNED NOT NULL,
+    oxygen_level_min TINYINT UNSIGNED NULL,
+    oxygen_level_max TINYINT UNSIGNED NULL,
+    oxygen_level_sum BIGINT UNSIGNED NOT NULL,
+    oxygen_level_count INT UNSIGNED NOT NULL,
+    PRIMARY KEY (userID, bucket, id),
+    KEY idx_vitals_hour_id (id),
+    FOREIGN KEY (userID) REFERENCES user(id)
+);
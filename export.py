@@ -0,0 +1,405 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: export.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module writes streamed log rows to export
+# files chunk by chunk, so memory use stays flat for any table size.
+# Besides CSV it writes typed columnar files for bulk analysis:
+# NumPy .npz (written with the standard library only) and Parquet
+# (needs the optional pyarrow package). Per-user exports split one
+# ordered scan into a file per user (and day), optionally with the
+# users partitioned across worker processes.
+# *****************************************************************************
+
+import os
+import csv
+import gzip
+import sys
+import time
+import shutil
+import zipfile
+import itertools
+import tempfile
+import multiprocessing
+from array import array
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import config
+import database
+
+# ********************** Constants ************************
+PROGRESS_INTERVAL = 1.0     # Seconds between progress lines
+GZIP_LEVEL = 6              # Good ratio without slowing the export down
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+# Column name and array typecode of the value column per log type
+VALUE_COLUMNS = {
+    'bpm': ("bpm", 'H'),
+    'oxygen': ("oxygen_level", 'B')
+}
+NPY_DESCR = {'B': "|u1", 'H': "<u2", 'I': "<u4", 'q': "<i8"}
+SPLIT_POSITIONS = {'bpm': 2, 'oxygen': 3}   # Value position per log type in a database.iter_vitals_chunks row
+PARTITIONS_PER_WORKER = 4   # User groups per worker process, so uneven groups even out
+
+
+def report_progress(count, elapsed, done=False):
+    """
+    *******************************
+    Function: report_progress
+    -------------------
+    Prints the number of rows written so far and the rows/sec rate,
+    overwriting the previous progress line until the export is done.
+
+    Input:  count (int), elapsed (float) - seconds, done (bool)
+    Output: None
+    *******************************
+    """
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"\r  {count} rows written ({rate:.0f} rows/sec)", end="\n" if done else "", flush=True)
+
+
+def track_progress(chunks, stats):
+    """
+    *******************************
+    Function: track_progress
+    -------------------
+    Passes row chunks through unchanged while counting the rows in
+    stats['rows'] and reporting progress every PROGRESS_INTERVAL
+    seconds. Prints the final count once the chunks are exhausted.
+
+    Input:  chunks (iterable of lists of tuples), stats (dict)
+    Output: generator of lists of tuples
+    *******************************
+    """
+    stats['rows'] = 0
+    start = last = time.monotonic()
+    for rows in chunks:
+        yield rows
+        stats['rows'] += len(rows)
+        now = time.monotonic()
+        if now - last >= PROGRESS_INTERVAL:
+            report_progress(stats['rows'], now - start)
+            last = now
+    report_progress(stats['rows'], time.monotonic() - start, done=True)
+
+
+def write_csv(filename, header, chunks, compress=False):
+    """
+    *******************************
+    Function: write_csv
+    -------------------
+    Writes a header and all row chunks to a CSV file, gzip-compressed
+    on the fly if requested. Reports progress while writing.
+
+    Input:  filename (str), header (list of str),
+            chunks (iterable of lists of tuples), compress (bool)
+    Output: int - Number of rows written
+    *******************************
+    """
+    stats = {}
+    with open_csv(filename, compress) as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for rows in track_progress(chunks, stats):
+            writer.writerows(rows)
+    return stats['rows']
+
+
+def open_csv(filename, compress=False):
+    """
+    *******************************
+    Function: open_csv
+    -------------------
+    Opens a CSV file for writing, gzip-compressed if requested.
+
+    Input:  filename (str), compress (bool)
+    Output: file object
+    *******************************
+    """
+    if compress:
+        return gzip.open(filename, mode="wt", compresslevel=GZIP_LEVEL, newline="", encoding="utf-8")
+    return open(filename, mode="w", newline="", encoding="utf-8")
+
+
+def write_split_csv(directory, tag, chunks, users, headers, per_day=False, compress=False):
+    """
+    *******************************
+    Function: write_split_csv
+    -------------------
+    Writes the rows of an ordered scan to one CSV file per user, or per
+    user and day, and log type. The rows arrive grouped, so only the
+    files of the current group are open. File names are those of a
+    single-user export, with the day after the username, e.g.
+    "bpm_logs_alice_2024-05-01_<tag>.csv".
+
+    Input:  directory (str), tag (str) - Export time in every file name
+            chunks (iterable of lists of tuples) - From
+                database.iter_vitals_chunks
+            users (dict)   - {user ID: username}
+            headers (dict) - {log type: value column header} of the
+                             log types to write
+            per_day (bool), compress (bool)
+    Output: int - Number of files written
+    *******************************
+    """
+    extension = "csv.gz" if compress else "csv"
+    if per_day:
+        group_key = lambda row: (row[0], row[1].date())
+    else:
+        group_key = lambda row: (row[0], None)
+    writers = {}
+    current = None
+    written = 0
+    try:
+        for rows in chunks:
+            for key, group in itertools.groupby(rows, group_key):
+                group = list(group)
+                if key != current:
+                    for file, _ in writers.values():
+                        file.close()
+                    writers.clear()
+                    current = key
+                # Timestamps are formatted once for all log types
+                stamps = [str(row[1]) for row in group]
+                for log_type, header in headers.items():
+                    position = SPLIT_POSITIONS[log_type]
+                    values = [(row[position], stamp) for row, stamp in zip(group, stamps) if row[position] is not None]
+                    if not values:
+                        continue
+                    if log_type not in writers:
+                        user_id, day = key
+                        name = users[user_id] if day is None else f"{users[user_id]}_{day}"
+                        file = open_csv(os.path.join(directory, f"{log_type}_logs_{name}_{tag}.{extension}"), compress)
+                        writers[log_type] = (file, csv.writer(file))
+                        writers[log_type][1].writerow([header, "Timestamp"])
+                        written += 1
+                    writers[log_type][1].writerows(values)
+    finally:
+        for file, _ in writers.values():
+            file.close()
+    return written
+
+
+def export_partition(users, headers, directory, tag, per_day=False, compress=False,
+                     start=None, end=None, db_config=None):
+    """
+    *******************************
+    Function: export_partition
+    -------------------
+    Exports the logs of a group of users with one ordered scan, split
+    into a file per user (and day) and log type. Runs in a worker
+    process when db_config is given: the database settings of the
+    parent, as a worker must not prompt for them.
+
+    Input:  users (dict) - {user ID: username}
+            headers, directory, tag, per_day, compress - See write_split_csv
+            start, end (datetime or None) - Optional range [start, end)
+            db_config (dict or None)
+    Output: Tuple (files, rows) - Files and readings written
+    *******************************
+    """
+    if db_config is not None:
+        config.DB_CONFIG.update(db_config)
+    stats = {'rows': 0}
+
+    def counted(chunks):
+        for rows in chunks:
+            stats['rows'] += len(rows)
+            yield rows
+
+    chunks = database.iter_vitals_chunks(sorted(users), start, end, prompt=db_config is None)
+    files = write_split_csv(directory, tag, counted(chunks), users, headers, per_day, compress)
+    return files, stats['rows']
+
+
+def export_per_user(users, headers, directory, per_day=False, compress=False, start=None, end=None, workers=1):
+    """
+    *******************************
+    Function: export_per_user
+    -------------------
+    Exports the logs of the given users to one CSV file per user (and
+    day) and log type, reading each reading once for all log types.
+    With workers > 1 the users are dealt out round-robin into groups
+    that worker processes export in parallel, each with a database
+    connection of its own. Reports progress while writing.
+
+    Input:  users (dict) - {user ID: username}
+            headers, directory, per_day, compress - See write_split_csv
+            start, end (datetime or None) - Optional range [start, end)
+            workers (int)
+    Output: Tuple (files, rows) - Files and readings written
+    *******************************
+    """
+    os.makedirs(directory, exist_ok=True)
+    tag = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if workers <= 1 or len(users) < 2:
+        stats = {}
+        chunks = track_progress(database.iter_vitals_chunks(sorted(users), start, end), stats)
+        files = write_split_csv(directory, tag, chunks, users, headers, per_day, compress)
+        return files, stats['rows']
+
+    user_ids = sorted(users)
+    count = min(len(user_ids), workers * PARTITIONS_PER_WORKER)
+    partitions = [{user_id: users[user_id] for user_id in user_ids[index::count]} for index in range(count)]
+    db_config = dict(config.DB_CONFIG)
+    files = rows = 0
+    begin = time.monotonic()
+    # Spawned, not forked: a fork would share the pooled connections of this process
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(export_partition, partition, headers, directory, tag,
+                                   per_day, compress, start, end, db_config)
+                   for partition in partitions]
+        for future in as_completed(futures):
+            done_files, done_rows = future.result()
+            files += done_files
+            rows += done_rows
+            report_progress(rows, time.monotonic() - begin)
+    report_progress(rows, time.monotonic() - begin, done=True)
+    return files, rows
+
+
+def to_columns(rows, log_type, usernames=None):
+    """
+    *******************************
+    Function: to_columns
+    -------------------
+    Converts one chunk of log rows to typed columns: the value as
+    uint16 (bpm) or uint8 (oxygen), the timestamp as int64 milliseconds
+    since 1970-01-01 (stored wall-clock time, counted as UTC) and, for
+    all-user rows, the username as a uint32 code into usernames.
+    A value that does not fit its column raises ValueError naming the
+    row, instead of the export writing a wrapped or partial column.
+
+    Input:  rows (list of tuples) - (username, value, timestamp) when
+                                    usernames is given, else (value, timestamp)
+            log_type (str)        - 'bpm' or 'oxygen'
+            usernames (dict or None) - username -> code, extended in place
+    Output: dict[str, array]
+    *******************************
+    """
+    name, typecode = VALUE_COLUMNS[log_type]
+    columns = {}
+    if usernames is not None:
+        names, values, stamps = zip(*rows)
+    else:
+        values, stamps = zip(*rows)
+    limit = 1 << (8 * array(typecode).itemsize)
+    if min(values) < 0 or max(values) >= limit:
+        index = next(index for index, value in enumerate(values) if not 0 <= value < limit)
+        owner = f" of user '{names[index]}'" if usernames is not None else ""
+        raise ValueError(f"Cannot export the {name} {values[index]}{owner} at {stamps[index]}: "
+                         f"the column holds 0 to {limit - 1}.")
+    if usernames is not None:
+        columns['username'] = array('I', [usernames.setdefault(n, len(usernames)) for n in names])
+    columns[name] = array(typecode, values)
+    columns['timestamp_ms'] = array('q', [(t - EPOCH) // MILLISECOND for t in stamps])
+    return columns
+
+
+def npy_header(descr, shape):
+    """
+    *******************************
+    Function: npy_header
+    -------------------
+    Builds a version 1.0 .npy header for a little-endian C-ordered array,
+    padded so the data starts on a 64-byte boundary.
+
+    Input:  descr (str) - NumPy type string, e.g. "<u2"
+            shape (tuple of int)
+    Output: bytes
+    *******************************
+    """
+    shape_text = f"({shape[0]},)" if len(shape) == 1 else str(shape)
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {shape_text}, }}"
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = header + " " * padding + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+def write_npz(filename, log_type, chunks, all_users):
+    """
+    *******************************
+    Function: write_npz
+    -------------------
+    Writes log rows to an uncompressed NumPy .npz archive without
+    needing NumPy. Each column is spooled to a temporary file while the
+    chunks stream in, then copied into the archive behind its header.
+    Columns: the value, 'timestamp_ms' and, for all users, 'username'
+    codes plus the 'usernames' dictionary they index.
+
+    Input:  filename (str), log_type (str) - 'bpm' or 'oxygen',
+            chunks (iterable of lists of tuples), all_users (bool)
+    Output: int - Number of rows written
+    *******************************
+    """
+    usernames = {} if all_users else None
+    spools = {}
+    stats = {}
+    try:
+        for rows in track_progress(chunks, stats):
+            for name, column in to_columns(rows, log_type, usernames).items():
+                if name not in spools:
+                    spools[name] = (column.typecode, tempfile.TemporaryFile())
+                if sys.byteorder == "big":
+                    column.byteswap()
+                column.tofile(spools[name][1])
+
+        with zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, (typecode, spool) in spools.items():
+                spool.seek(0)
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    member.write(npy_header(NPY_DESCR[typecode], (stats['rows'],)))
+                    shutil.copyfileobj(spool, member)
+            if usernames is not None:
+                width = max((len(n) for n in usernames), default=1)
+                data = b"".join(n.ljust(width, "\0").encode("utf-32-le") for n in usernames)
+                archive.writestr("usernames.npy", npy_header(f"<U{width}", (len(usernames),)) + data)
+    finally:
+        for _, spool in spools.values():
+            spool.close()
+    return stats['rows']
+
+
+def write_parquet(filename, log_type, chunks, all_users):
+    """
+    *******************************
+    Function: write_parquet
+    -------------------
+    Writes log rows to a Parquet file, one row group per chunk, with
+    the same typed columns as write_npz. The username column is
+    dictionary-encoded. Requires the optional pyarrow package.
+
+    Input:  filename (str), log_type (str) - 'bpm' or 'oxygen',
+            chunks (iterable of lists of tuples), all_users (bool)
+    Output: int - Number of rows written
+    *******************************
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("The parquet format requires pyarrow (pip install pyarrow).")
+
+    name, typecode = VALUE_COLUMNS[log_type]
+    fields = [(name, pa.uint16() if typecode == 'H' else pa.uint8()), ('timestamp_ms', pa.int64())]
+    if all_users:
+        fields.insert(0, ('username', pa.dictionary(pa.int32(), pa.string())))
+    schema = pa.schema(fields)
+
+    stats = {}
+    with pq.ParquetWriter(filename, schema) as writer:
+        for rows in track_progress(chunks, stats):
+            if all_users:
+                columns = to_columns([row[1:] for row in rows], log_type)
+                columns['username'] = pa.array([row[0] for row in rows], pa.string()).dictionary_encode()
+            else:
+                columns = to_columns(rows, log_type)
+            writer.write_table(pa.table({field: columns[field] for field, _ in fields}, schema=schema))
+    return stats['rows']
@@ -0,0 +1,332 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: importer.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module bulk-loads readings from files: CSV
+# exports written by output_to_csv (plain or .csv.gz) and raw device
+# captures ("bpm:<n>oxy:<n>" lines, optionally prefixed with a time
+# stamp as written by serial loggers). Files are streamed in batches,
+# usernames are resolved against one cached lookup of all users and
+# every batch goes to the database in a single bulk transaction.
+# Files can be parsed in parallel by worker processes. Values no person
+# can have (see protocol.possible) are counted as malformed.
+# *****************************************************************************
+
+import os
+import re
+import csv
+import gzip
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import database
+from export import track_progress
+from protocol import LINE_PATTERN, possible
+from spool import RECORD, pack_rows, unpack_rows
+
+# ********************** Constants ************************
+IMPORT_BATCH = 10000        # Rows per bulk insert transaction
+READ_SIZE = 1 << 20         # Bytes of a capture file parsed at a time
+CSV_VALUES = {              # Value column header of an export -> its index in a parsed row
+    "BPM": 2,
+    "Oxygen Level": 3
+}
+EXPORT_NAME = re.compile(r"^(?:bpm|oxygen)_logs_(.+?)(?:_\d{4}-\d\d-\d\d)?_\d{8}_\d{6}\.csv(?:\.gz)?$")
+
+# The protocol line, optionally after a "[2024-05-01 10:00:00.125]"
+# or "2024-05-01T10:00:00.125" time stamp
+_LINE_START = rb"^[ \t]*"
+assert LINE_PATTERN.pattern.startswith(_LINE_START)
+CAPTURE_PATTERN = re.compile(
+    _LINE_START + rb"(?:\[?(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:\.\d{1,6})?)\]?[ \t]*)?"
+    + LINE_PATTERN.pattern[len(_LINE_START):],
+    re.MULTILINE
+)
+
+
+def username_from_filename(path):
+    """
+    *******************************
+    Function: username_from_filename
+    -------------------
+    Recovers the username from the file name of a single-user export,
+    e.g. "bpm_logs_alice_20240501_120000.csv", or of a per-user and
+    day export, e.g. "bpm_logs_alice_2024-05-01_20240501_120000.csv".
+
+    Input:  path (str)
+    Output: str or None
+    *******************************
+    """
+    match = EXPORT_NAME.match(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def read_csv(path, username, stats):
+    """
+    *******************************
+    Function: read_csv
+    -------------------
+    Streams the readings of a BPM or oxygen level export. All-user
+    exports name the user in every row; single-user exports use the
+    given username or the one in the file name. Rows whose value is
+    not a number or not possible for its vital are malformed.
+
+    Input:  path (str), username (str or None),
+            stats (dict) - 'malformed' is increased for bad rows
+    Output: generator of lists of tuples
+            (username, timestamp, bpm, oxygen_level)
+    *******************************
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return
+        all_users = header[0] == "Username"
+        position = CSV_VALUES.get(header[1] if all_users else header[0])
+        if position is None:
+            raise ValueError(f"'{path}' is not a BPM or oxygen level export.")
+        if not all_users:
+            username = username or username_from_filename(path)
+            if not username:
+                raise ValueError(f"No username given for '{path}'.")
+
+        batch = []
+        for row in reader:
+            try:
+                if all_users:
+                    name, value, stamp = row
+                else:
+                    value, stamp = row
+                    name = username
+                value = int(value)
+                stamp = datetime.fromisoformat(stamp)
+            except ValueError:
+                stats['malformed'] += 1
+                continue
+            if position == 2:
+                reading = (name, stamp, value, None)
+            else:
+                reading = (name, stamp, None, value)
+            if not possible(*reading[2:]):
+                stats['malformed'] += 1
+                continue
+            batch.append(reading)
+            if len(batch) >= IMPORT_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def read_capture(path, username, stats):
+    """
+    *******************************
+    Function: read_capture
+    -------------------
+    Streams the readings of a raw device capture, block by block.
+    A line without a time stamp gets the one of the line before it;
+    lines before the first stamp get the file's modification time.
+    Lines with impossible values are malformed.
+
+    Input:  path (str), username (str),
+            stats (dict) - 'malformed' is increased for bad lines
+    Output: generator of lists of tuples
+            (username, timestamp, bpm, oxygen_level)
+    *******************************
+    """
+    if not username:
+        raise ValueError(f"No username given for the capture '{path}'.")
+    stamp = datetime.fromtimestamp(os.path.getmtime(path))
+    rest = b""
+    batch = []
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            block = rest + data
+            if data:
+                end = block.rfind(b"\n") + 1
+                block, rest = block[:end], block[end:]
+            if block:
+                matched = 0
+                for match in CAPTURE_PATTERN.finditer(block):
+                    matched += 1
+                    text, bpm, oxy, oxy_first, bpm_last, bpm_only, oxy_only = match.groups()
+                    if text is not None:
+                        stamp = datetime.fromisoformat(text.decode())
+                    if bpm is not None:
+                        values = (int(bpm), int(oxy))
+                    elif oxy_first is not None:
+                        values = (int(bpm_last), int(oxy_first))
+                    elif bpm_only is not None:
+                        values = (int(bpm_only), None)
+                    elif oxy_only is not None:
+                        values = (None, int(oxy_only))
+                    else:
+                        continue
+                    if possible(*values):
+                        batch.append((username, stamp) + values)
+                    else:
+                        matched -= 1
+                # A block ending in a newline matches once more, after it
+                stats['malformed'] += block.count(b"\n") + 1 - matched
+                if len(batch) >= IMPORT_BATCH:
+                    yield batch
+                    batch = []
+            if not data:
+                break
+    if batch:
+        yield batch
+
+
+def read_file(path, username, stats):
+    """
+    *******************************
+    Function: read_file
+    -------------------
+    Streams the readings of an export (.csv, .csv.gz) or, for any
+    other extension, a raw capture.
+
+    Input:  path (str), username (str or None), stats (dict)
+    Output: generator of lists of tuples
+            (username, timestamp, bpm, oxygen_level)
+    *******************************
+    """
+    if path.endswith((".csv", ".csv.gz")):
+        return read_csv(path, username, stats)
+    return read_capture(path, username, stats)
+
+
+def parse_packed(path, username, user_ids):
+    """
+    *******************************
+    Function: parse_packed
+    -------------------
+    Worker process task: parses a whole file and resolves its usernames
+    against a copy of the user IDs. Readings of known users come back
+    as spool records, which are cheap to send to the importing process;
+    the few of other users come back as they are.
+
+    Input:  path (str), username (str or None),
+            user_ids (dict) - {lower-case username: user ID}
+    Output: Tuple (records (bytes), unknown (list of tuples
+            (username, timestamp, bpm, oxygen_level)), malformed (int))
+    *******************************
+    """
+    stats = {'malformed': 0}
+    parts = []
+    unknown = []
+    for batch in read_file(path, username, stats):
+        rows = []
+        for name, stamp, bpm, oxygen_level in batch:
+            user_id = user_ids.get(name.lower())
+            if user_id is None:
+                unknown.append((name, stamp, bpm, oxygen_level))
+            else:
+                rows.append((user_id, stamp, bpm, oxygen_level, None, None))
+        parts.append(pack_rows(rows))
+    return b"".join(parts), unknown, stats['malformed']
+
+
+def import_files(paths, username=None, create_users=False, workers=1):
+    """
+    *******************************
+    Function: import_files
+    -------------------
+    Imports readings from export and capture files into the vitals
+    table, reporting progress. With workers > 1 the files are parsed
+    and resolved by that many processes while this one inserts, which
+    pays off for many files; each worker holds one parsed file in
+    memory. A file that cannot be read is reported
+    and skipped; batches already inserted from it stay.
+
+    Input:  paths (list of str)
+            username (str or None) - User of captures and single-user
+                                     exports, default from the file name
+            create_users (bool)    - Add unknown users (age 0) instead
+                                     of skipping their readings
+            workers (int)
+    Output: dict - 'rows', 'malformed', 'skipped' (readings of unknown
+            users), 'unknown' and 'created' (usernames), 'failed'
+            (list of (path, error))
+    *******************************
+    """
+    stats = {'rows': 0, 'malformed': 0, 'skipped': 0, 'unknown': set(), 'created': [], 'failed': []}
+    user_ids = database.load_user_ids()
+
+    def resolve(batches):
+        for batch in batches:
+            if isinstance(batch, bytes):     # Records of a worker, already resolved
+                yield unpack_rows(batch)
+                continue
+            rows = []
+            for name, stamp, bpm, oxygen_level in batch:
+                user_id = user_ids.get(name.lower())
+                if user_id is None:
+                    user_id = _missing_user(name, user_ids, create_users, stats)
+                    if user_id is None:
+                        stats['skipped'] += 1
+                        continue
+                rows.append((user_id, stamp, bpm, oxygen_level, None, None))
+            if rows:
+                yield rows
+
+    def batches():
+        if workers > 1:
+            # Spawned, not forked: a fork would share the pooled connection of load_user_ids
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [(path, executor.submit(parse_packed, path, username, user_ids)) for path in paths]
+                for path, future in futures:
+                    try:
+                        records, unknown, malformed = future.result()
+                    except (OSError, ValueError, csv.Error) as e:
+                        stats['failed'].append((path, e))
+                        continue
+                    stats['malformed'] += malformed
+                    step = IMPORT_BATCH * RECORD.size
+                    for offset in range(0, len(records), step):
+                        yield records[offset:offset + step]
+                    for offset in range(0, len(unknown), IMPORT_BATCH):
+                        yield unknown[offset:offset + IMPORT_BATCH]
+        else:
+            for path in paths:
+                try:
+                    yield from read_file(path, username, stats)
+                except (OSError, ValueError, csv.Error) as e:
+                    stats['failed'].append((path, e))
+
+    progress = {}
+    for rows in track_progress(resolve(batches()), progress):
+        database.bulk_insert_vitals(rows)
+    stats['rows'] = progress['rows']
+    return stats
+
+
+def _missing_user(name, user_ids, create_users, stats):
+    """
+    *******************************
+    Function: _missing_user
+    -------------------
+    Handles a username that is not in the database: adds the user if
+    create_users is set, otherwise remembers it as unknown.
+
+    Input:  name (str), user_ids (dict) - extended in place,
+            create_users (bool), stats (dict)
+    Output: int or None - New user ID
+    *******************************
+    """
+    key = name.lower()
+    if not create_users or key in stats['unknown']:
+        stats['unknown'].add(key)
+        return None
+    database.add_user(name, 0)
+    user_ids[key] = database.get_user_id(name)
+    stats['created'].append(name)
+    return user_ids[key]
@@ -14,7 +14,10 @@
 #
 # *****************************************************************************
 
+import sys
+import multiprocessing
 from commands import execute_command, get_available_commands
+from spool import spool_pending, get_spool
 
 
 def main():
@@ -26,7 +29,10 @@ def main():
 
     Initializes the command-line interface, prints a welcome message,
     and waits for user input in a loop. Delegates command handling
-    to the `execute_command` function.
+    to the `execute_command` function. Readings left in the spool by
+    an earlier session are loaded in the background, unless another
+    process has the spool open and loads them itself. Started with
+    --profile, every command runs under the profiler (see profiler.py).
 
     Input:  None
     Output: None
@@ -34,11 +40,28 @@ def main():
     """
     print("BPM Terminal App")
     print("Type 'help' to see available commands or 'exit' to quit.")
+    profiling = "--profile" in sys.argv[1:]
+    if profiling:
+        print("Profiling every command.")
+    pending = spool_pending()
+    if pending:
+        try:
+            get_spool()
+            print(f"Loading {pending} spooled readings from an earlier session in the background.")
+        except RuntimeError:
+            # Another process has the spool open and loads it
+            pass
 
     while True:
         command = input("> ").strip().lower()
-        execute_command(command)
+        if profiling and command and command.split()[0] != 'profile':
+            from profiler import profile_command
+            profile_command(command, execute_command)
+        else:
+            execute_command(command)
 
 
 if __name__ == "__main__":
+    # Lets the export worker processes start in a frozen executable
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,388 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: metrics.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module instruments the ingest path: counters,
+# latency histograms per stage (serial read, queue wait, parse, spool
+# append and fsync, database write and commit, end to end) and gauges
+# such as queue depths. Recording is a few additions per chunk or
+# batch, never per reading, so it stays on all the time. The numbers
+# are shown by the 'stats' command and can be exported in Prometheus
+# text format to a file or a local HTTP endpoint (see metrics.cfg).
+# Every metric is written from one thread at a time; readers take
+# lock-free snapshots, which may be a few updates behind.
+# *****************************************************************************
+
+import os
+import time
+import threading
+from bisect import bisect_left
+
+# ********************** Constants ************************
+PREFIX = "bpm_ingest_"
+LATENCY_BUCKETS = (         # Upper bounds in seconds; a last bucket takes the rest
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+STAGES = {                  # Histogram name: what it times
+    'read': "Serial read call per chunk",
+    'queue_wait': "Time read bytes wait for the parser",
+    'parse': "Framing, parsing and analytics per chunk",
+    'spool_append': "Appending the readings of a chunk to the spool",
+    'spool_sync': "Spool fsync",
+    'db_write': "Database write per batch",
+    'db_commit': "Database commit per batch",
+    'end_to_end': "Arrival of the oldest reading of a batch until its commit"
+}
+COUNTERS = {                # Counter name: what it counts
+    'bytes_read': "Bytes read from serial ports",
+    'samples_parsed': "Samples parsed from serial lines",
+    'lines_malformed': "Malformed serial lines",
+    'readings_spooled': "Readings appended to the spool",
+    'rows_committed': "Readings committed to the database",
+    'readings_rejected': "Spooled readings the database refused, moved to the reject file",
+    'db_errors': "Failed spool loads into the database"
+}
+TEXTFILE_INTERVAL = 5.0     # Seconds between rewrites of the Prometheus text file
+
+
+class Histogram:
+    """
+    *******************************
+    Class: Histogram
+    -------------------
+    Latency histogram with fixed LATENCY_BUCKETS, as Prometheus
+    expects them, plus the largest value seen.
+
+    Attributes:
+        counts (list of int) - Values per bucket, not cumulative
+        total (float)        - Sum of all values
+        count (int)          - Number of values
+        maximum (float)
+    *******************************
+    """
+
+    __slots__ = ('counts', 'total', 'count', 'maximum')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        *******************************
+        Function: clear
+        -------------------
+        Forgets every value.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.maximum = 0.0
+
+    def observe(self, value):
+        """
+        *******************************
+        Function: observe
+        -------------------
+        Records one value.
+
+        Input:  value (float) - Seconds
+        Output: None
+        *******************************
+        """
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.maximum:
+            self.maximum = value
+
+    def quantile(self, fraction):
+        """
+        *******************************
+        Function: quantile
+        -------------------
+        Estimates a quantile as the upper bound of the bucket it falls
+        in (the maximum for the last bucket).
+
+        Input:  fraction (float) - 0..1
+        Output: float or None without values
+        *******************************
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+
+def histogram(name):
+    """
+    *******************************
+    Function: histogram
+    -------------------
+    Returns the histogram of a stage, for callers that record often
+    and keep it at hand.
+
+    Input:  name (str) - Key in STAGES
+    Output: Histogram
+    *******************************
+    """
+    return _histograms[name]
+
+
+def observe(name, seconds):
+    """
+    *******************************
+    Function: observe
+    -------------------
+    Records the duration of one run of a stage.
+
+    Input:  name (str) - Key in STAGES, seconds (float)
+    Output: None
+    *******************************
+    """
+    _histograms[name].observe(seconds)
+
+
+def inc(name, amount=1):
+    """
+    *******************************
+    Function: inc
+    -------------------
+    Increases a counter.
+
+    Input:  name (str) - Key in COUNTERS, amount (int)
+    Output: None
+    *******************************
+    """
+    _counters[name] += amount
+
+
+def counter(name):
+    """
+    *******************************
+    Function: counter
+    -------------------
+    Returns the current value of a counter.
+
+    Input:  name (str) - Key in COUNTERS
+    Output: int
+    *******************************
+    """
+    return _counters[name]
+
+
+def set_gauges(gauges):
+    """
+    *******************************
+    Function: set_gauges
+    -------------------
+    Replaces the gauges, which are read when metrics are reported,
+    e.g. queue depths while ingestion runs.
+
+    Input:  gauges (dict) - {name: (description, function returning a number)}
+    Output: None
+    *******************************
+    """
+    global _gauges
+    _gauges = dict(gauges)
+
+
+def reset():
+    """
+    *******************************
+    Function: reset
+    -------------------
+    Sets every counter and histogram back to zero. Histograms are
+    cleared in place, so references from histogram() stay valid.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    global _started, _last_stats
+    for name in STAGES:
+        _histograms.setdefault(name, Histogram()).clear()
+    for name in COUNTERS:
+        _counters[name] = 0
+    _started = time.monotonic()
+    _last_stats = (_started, 0)
+
+
+def gauge_values():
+    """
+    *******************************
+    Function: gauge_values
+    -------------------
+    Reads the current value of every gauge, skipping any that fails.
+
+    Input:  None
+    Output: list of tuples (name, description, number)
+    *******************************
+    """
+    values = []
+    for name, (description, function) in _gauges.items():
+        try:
+            values.append((name, description, function()))
+        except Exception:
+            pass
+    return values
+
+
+def format_stats():
+    """
+    *******************************
+    Function: format_stats
+    -------------------
+    Formats the metrics as a table for the terminal: totals, the commit
+    rate since start and since the previous call, the malformed line
+    rate, gauges and the latency of every stage that ran.
+
+    Input:  None
+    Output: str
+    *******************************
+    """
+    global _last_stats
+    now = time.monotonic()
+    committed = _counters['rows_committed']
+    since, committed_then = _last_stats
+    _last_stats = (now, committed)
+    lines_seen = _counters['samples_parsed'] + _counters['lines_malformed']
+    error_rate = _counters['lines_malformed'] / lines_seen if lines_seen else 0.0
+
+    lines = [
+        f"Ingest metrics of the last {now - _started:.0f} s:",
+        f"  {_counters['bytes_read']} bytes read, {_counters['samples_parsed']} samples parsed, "
+        f"{_counters['lines_malformed']} malformed lines ({error_rate:.2%})",
+        f"  {_counters['readings_spooled']} readings spooled, {committed} committed "
+        f"({committed / max(now - _started, 1e-9):.1f} rows/s overall, "
+        f"{(committed - committed_then) / max(now - since, 1e-9):.1f} rows/s since the last 'stats'), "
+        f"{_counters['db_errors']} failed loads, {_counters['readings_rejected']} rejected readings"
+    ]
+    gauges = gauge_values()
+    if gauges:
+        lines.append("  " + ", ".join(f"{name} {value}" for name, _, value in gauges))
+    lines.append(f"  {'Stage':<14}{'Count':>10}{'Mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'Max ms':>10}")
+    for name, stage in _histograms.items():
+        if stage.count:
+            lines.append(f"  {name:<14}{stage.count:>10}{stage.total / stage.count * 1000.0:>10.3f}"
+                         f"{stage.quantile(0.50) * 1000.0:>10.3f}{stage.quantile(0.99) * 1000.0:>10.3f}"
+                         f"{stage.maximum * 1000.0:>10.3f}")
+    return "\n".join(lines)
+
+
+def format_prometheus():
+    """
+    *******************************
+    Function: format_prometheus
+    -------------------
+    Formats the metrics in the Prometheus text exposition format.
+
+    Input:  None
+    Output: str
+    *******************************
+    """
+    lines = []
+    for name, description in COUNTERS.items():
+        lines += [f"# HELP {PREFIX}{name}_total {description}",
+                  f"# TYPE {PREFIX}{name}_total counter",
+                  f"{PREFIX}{name}_total {_counters[name]}"]
+    for name, description, value in gauge_values():
+        lines += [f"# HELP {PREFIX}{name} {description}",
+                  f"# TYPE {PREFIX}{name} gauge",
+                  f"{PREFIX}{name} {value}"]
+    for name, description in STAGES.items():
+        stage = _histograms[name]
+        metric = f"{PREFIX}{name}_seconds"
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stage.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'{metric}_bucket{{le="+Inf"}} {stage.count}',
+                  f"{metric}_sum {stage.total}",
+                  f"{metric}_count {stage.count}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    """
+    *******************************
+    Function: write_textfile
+    -------------------
+    Writes the metrics to a Prometheus text file, e.g. for the node
+    exporter's textfile collector, replacing it in one step so a
+    scraper never reads half a file.
+
+    Input:  path (str)
+    Output: None
+    *******************************
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        f.write(format_prometheus())
+    os.replace(temporary, path)
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    *******************************
+    Function: start_http_server
+    -------------------
+    Serves the metrics in Prometheus text format on /metrics from a
+    background thread, once per process. Only local connections are
+    accepted by default.
+
+    Input:  port (int), host (str)
+    Output: None
+    *******************************
+    """
+    global _server
+    if _server is not None:
+        return
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = format_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+# ******************** Variables ************************
+_histograms = {}
+_counters = {}
+_gauges = {}
+_started = None
+_last_stats = None
+_server = None
+
+# ******************** Runtime Initialization ********************
+reset()
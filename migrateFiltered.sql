@@ -0,0 +1,9 @@
+-- Adds the filtered columns of the live analytics stage to a vitals
+-- table created before they existed. Run once; the SQLite backend
+-- adds them by itself.
+
+USE bio_metric_database;
+
+ALTER TABLE vitals
+    ADD COLUMN bpm_filtered SMALLINT UNSIGNED NULL AFTER oxygen_level,
+    ADD COLUMN oxygen_filtered TINYINT UNSIGNED NULL AFTER bpm_filtered;
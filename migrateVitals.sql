@@ -0,0 +1,49 @@
+-- Migrates a database created by the old setupDatabase.sql (separate
+-- bpm_table and oxygen_level_table with TIME stamps) to the vitals table.
+--
+-- The old TIME columns carry no date, so migrated readings are placed on
+-- the date the user was created. BPM and oxygen rows logged from the same
+-- line share userID and time_stamp; they are paired in insertion order
+-- and stored as one vitals row. Unpaired rows keep NULL in the other column.
+-- Requires MySQL 8.0 (window functions).
+
+USE bio_metric_database;
+
+CREATE TABLE IF NOT EXISTS vitals (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    userID INT NOT NULL,
+    time_stamp DATETIME(3) NOT NULL,
+    bpm SMALLINT UNSIGNED NULL,
+    oxygen_level TINYINT UNSIGNED NULL,
+    bpm_filtered SMALLINT UNSIGNED NULL,
+    oxygen_filtered TINYINT UNSIGNED NULL,
+    PRIMARY KEY (userID, time_stamp, id),
+    KEY idx_vitals_id (id),
+    FOREIGN KEY (userID) REFERENCES user(id)
+);
+
+INSERT INTO vitals (userID, time_stamp, bpm, oxygen_level)
+WITH
+    b AS (
+        SELECT userID, time_stamp, bpm,
+               ROW_NUMBER() OVER (PARTITION BY userID, time_stamp ORDER BY id) AS n
+        FROM bpm_table
+    ),
+    o AS (
+        SELECT userID, time_stamp, oxygen_level,
+               ROW_NUMBER() OVER (PARTITION BY userID, time_stamp ORDER BY id) AS n
+        FROM oxygen_level_table
+    )
+SELECT b.userID, TIMESTAMP(DATE(u.created_at), b.time_stamp), b.bpm, o.oxygen_level
+FROM b
+INNER JOIN `user` u ON u.id = b.userID
+LEFT JOIN o ON o.userID = b.userID AND o.time_stamp = b.time_stamp AND o.n = b.n
+UNION ALL
+SELECT o.userID, TIMESTAMP(DATE(u.created_at), o.time_stamp), NULL, o.oxygen_level
+FROM o
+INNER JOIN `user` u ON u.id = o.userID
+LEFT JOIN b ON b.userID = o.userID AND b.time_stamp = o.time_stamp AND b.n = o.n
+WHERE b.userID IS NULL;
+
+DROP TABLE bpm_table;
+DROP TABLE oxygen_level_table;
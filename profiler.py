@@ -0,0 +1,157 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: profiler.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module profiles single terminal commands: it
+# runs a command under cProfile and tracemalloc and reports the
+# slowest functions, the time spent in each database function and
+# the peak memory with its largest allocation sites. The full report
+# and the raw cProfile data (for pstats or snakeviz) are written to
+# PROFILE_DIR; a short summary is printed. Only the thread running the
+# command is profiled, not background threads such as the spool
+# drainer. Time spent waiting for input at a prompt is included.
+# *****************************************************************************
+
+import io
+import os
+import time
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+
+# ********************** Constants ************************
+PROFILE_DIR = "profiles"
+DB_MODULES = ("database.py", "storage_mysql.py", "storage_sqlite.py")
+SUMMARY_ROWS = 5            # Rows per table in the printed summary
+REPORT_ROWS = 30            # Rows per table in the report file
+TRACE_FRAMES = 5            # Stack frames kept per allocation
+
+
+def profile_command(command, execute):
+    """
+    *******************************
+    Function: profile_command
+    -------------------
+    Runs one command under cProfile and tracemalloc, then writes the
+    report files and prints the summary. Exceptions of the command,
+    including SystemExit from 'exit', are passed on after reporting.
+
+    Input:  command (str)      - Command line, used to label the report
+            execute (callable) - execute(command) runs it
+    Output: None
+    *******************************
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(TRACE_FRAMES)
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        profiler.runcall(execute, command)
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ))
+        if not tracing:
+            tracemalloc.stop()
+        report_profile(command, profiler, snapshot, elapsed, peak)
+
+
+def function_table(stats, rows, modules=None):
+    """
+    *******************************
+    Function: function_table
+    -------------------
+    Lists the functions with the most cumulative time, optionally only
+    those defined in the given modules.
+
+    Input:  stats (pstats.Stats), rows (int),
+            modules (tuple of str or None) - File names to keep
+    Output: list of tuples (name, calls, cumulative seconds, own seconds)
+    *******************************
+    """
+    table = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        if modules is not None and os.path.basename(filename) not in modules:
+            continue
+        if filename == "~":
+            name = function
+        else:
+            name = f"{os.path.basename(filename)}:{line}({function})"
+        table.append((name, calls, cumulative, own))
+    table.sort(key=lambda entry: entry[2], reverse=True)
+    return table[:rows]
+
+
+def format_profile(command, stats, snapshot, elapsed, peak, rows):
+    """
+    *******************************
+    Function: format_profile
+    -------------------
+    Formats the tables of a profile: database functions and all
+    functions by cumulative time, and the largest allocation sites.
+
+    Input:  command (str), stats (pstats.Stats),
+            snapshot (tracemalloc.Snapshot), elapsed (float) - seconds,
+            peak (int) - bytes, rows (int) - Rows per table
+    Output: str
+    *******************************
+    """
+    lines = [f"Profile of '{command}': {elapsed:.3f} s, peak memory {peak / 2**20:.1f} MiB"]
+    for title, table in (("Database time per function", function_table(stats, rows, DB_MODULES)),
+                         ("Slowest functions", function_table(stats, rows))):
+        lines.append(f"  {title} (cumulative):")
+        lines.append(f"    {'Function':<56}{'Calls':>9}{'Cum s':>10}{'Own s':>10}")
+        for name, calls, cumulative, own in table:
+            lines.append(f"    {name[-56:]:<56}{calls:>9}{cumulative:>10.4f}{own:>10.4f}")
+        if not table:
+            lines.append("    (none)")
+    lines.append("  Largest allocations still held at the end:")
+    for statistic in snapshot.statistics("lineno")[:rows]:
+        frame = statistic.traceback[0]
+        site = f"{os.path.basename(frame.filename)}:{frame.lineno}"
+        lines.append(f"    {site:<56}{statistic.size / 1024:>10.1f} KiB in {statistic.count} blocks")
+    return "\n".join(lines)
+
+
+def report_profile(command, profiler, snapshot, elapsed, peak):
+    """
+    *******************************
+    Function: report_profile
+    -------------------
+    Writes the full report (tables plus the pstats listing) and the raw
+    cProfile data to PROFILE_DIR and prints the summary.
+
+    Input:  command (str), profiler (cProfile.Profile),
+            snapshot (tracemalloc.Snapshot), elapsed (float), peak (int)
+    Output: None
+    *******************************
+    """
+    stats = pstats.Stats(profiler)
+    label = "_".join(command.split()) or "command"
+    base = os.path.join(PROFILE_DIR, f"profile_{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    listing = io.StringIO()
+    pstats.Stats(profiler, stream=listing).sort_stats("cumulative").print_stats(REPORT_ROWS)
+    print(format_profile(command, stats, snapshot, elapsed, peak, SUMMARY_ROWS))
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stats.dump_stats(base + ".prof")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(format_profile(command, stats, snapshot, elapsed, peak, REPORT_ROWS))
+            f.write("\n\n" + listing.getvalue())
+        print(f"Full report in '{base}.txt', cProfile data in '{base}.prof'.")
+    except OSError as e:
+        print(f"Could not write the profile report: {e}")
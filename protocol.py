@@ -0,0 +1,137 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: protocol.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module frames and parses the microcontroller's
+# line protocol, "bpm:<value>oxy:<value>" (either order, or only one
+# of the two), straight from raw serial bytes. Bytes are collected in
+# one reusable buffer and every complete block of lines is parsed with
+# a single precompiled pattern, so high-rate or garbage-heavy streams
+# are not held back by per-line string handling. Values no person can
+# have (above MAX_BPM or MAX_OXYGEN_LEVEL) make a line malformed, so
+# they never reach the spool or the database.
+# *****************************************************************************
+
+import re
+from collections import namedtuple
+
+# ********************** Constants ************************
+MAX_LINE_LENGTH = 256       # Longer partial lines are discarded as garbage
+MAX_BPM = 300               # Highest physically possible heart rate
+MAX_OXYGEN_LEVEL = 100      # Oxygen saturation in percent
+
+# One sample per line. Each line matches exactly one alternative, or
+# the empty one for blank lines; any other line is malformed.
+LINE_PATTERN = re.compile(
+    rb"^[ \t]*(?:"
+    rb"bpm:[ \t]*(\d{1,3})[ \t]*oxy:[ \t]*(\d{1,3})"
+    rb"|oxy:[ \t]*(\d{1,3})[ \t]*bpm:[ \t]*(\d{1,3})"
+    rb"|bpm:[ \t]*(\d{1,3})"
+    rb"|oxy:[ \t]*(\d{1,3})"
+    rb"|)[ \t\r]*$",
+    re.MULTILINE
+)
+
+Sample = namedtuple('Sample', ['bpm', 'oxygen_level'])
+
+
+def possible(bpm, oxygen_level):
+    """
+    *******************************
+    Function: possible
+    -------------------
+    Checks that a reading holds values a person can have. Plausibility
+    beyond that (artifacts, sensor glitches) is judged by analytics.py.
+
+    Input:  bpm (int or None), oxygen_level (int or None)
+    Output: bool
+    *******************************
+    """
+    return ((bpm is None or 0 <= bpm <= MAX_BPM)
+            and (oxygen_level is None or 0 <= oxygen_level <= MAX_OXYGEN_LEVEL))
+
+
+class LineFramer:
+    """
+    *******************************
+    Class: LineFramer
+    -------------------
+    Splits a serial byte stream into lines and parses them into
+    Sample records. Keeps the trailing partial line between calls
+    and counts malformed lines instead of reporting each one.
+
+    Attributes:
+        samples   (int) - Samples parsed so far
+        malformed (int) - Lines that did not match the protocol or
+                          held impossible values
+    *******************************
+    """
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.buffer = bytearray()
+        self.max_line_length = max_line_length
+        self.samples = 0
+        self.malformed = 0
+        self.discarding = False     # Inside a line already counted as malformed
+
+    def feed(self, data):
+        """
+        *******************************
+        Function: feed
+        -------------------
+        Adds received bytes and parses every line they complete. A line
+        outgrowing max_line_length is counted as malformed once and
+        discarded up to its newline.
+
+        Input:  data (bytes) - Raw bytes read from the port
+        Output: list of Sample
+        *******************************
+        """
+        buffer = self.buffer
+        buffer += data
+        end = buffer.rfind(b"\n")
+        if end < 0:
+            if len(buffer) > self.max_line_length:
+                buffer.clear()
+                if not self.discarding:
+                    self.malformed += 1
+                    self.discarding = True
+            return []
+        if self.discarding:
+            del buffer[:buffer.find(b"\n") + 1]
+            self.discarding = False
+            end = buffer.rfind(b"\n")
+            if end < 0:
+                return []
+
+        block = bytes(buffer[:end + 1])
+        del buffer[:end + 1]
+        samples = []
+        matched = 0
+        for match in LINE_PATTERN.finditer(block):
+            matched += 1
+            bpm, oxy, oxy_first, bpm_last, bpm_only, oxy_only = match.groups()
+            if bpm is not None:
+                sample = Sample(int(bpm), int(oxy))
+            elif oxy_first is not None:
+                sample = Sample(int(bpm_last), int(oxy_first))
+            elif bpm_only is not None:
+                sample = Sample(int(bpm_only), None)
+            elif oxy_only is not None:
+                sample = Sample(None, int(oxy_only))
+            else:
+                continue
+            if possible(*sample):
+                samples.append(sample)
+            else:
+                matched -= 1
+        # The last "line" after the final newline is empty and matches too
+        self.malformed += block.count(b"\n") + 1 - matched
+        self.samples += len(samples)
+        return samples
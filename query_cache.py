@@ -0,0 +1,166 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: query_cache.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module keeps the results of log queries in
+# memory, least recently used first out, bounded by an estimate of
+# their size in bytes. Every user has a write version that the
+# database module bumps after each committed change to their logs;
+# all-user results depend on a version bumped by any change. A result
+# is stored with the version read before its query ran and is only
+# served while that version is current, so a write that commits while
+# a query runs can never leave a stale result behind. Only writes made
+# by this process are seen: call clear() after changing logs elsewhere.
+# *****************************************************************************
+
+import sys
+import threading
+from collections import OrderedDict
+
+# ********************** Constants ************************
+CACHE_BYTES = 64 << 20      # Most bytes of results kept
+ENTRY_BYTES = CACHE_BYTES // 8  # Larger results are not kept
+
+
+def version(user_id=None):
+    """
+    *******************************
+    Function: version
+    -------------------
+    Returns the write version that results about one user, or about
+    all users, depend on. Read it before running the query.
+
+    Input:  user_id (int or None) - None for all users
+    Output: Hashable version
+    *******************************
+    """
+    with _lock:
+        if user_id is None:
+            return _total
+        return _versions.get(user_id, 0), _epoch
+
+
+def bump(user_ids):
+    """
+    *******************************
+    Function: bump
+    -------------------
+    Marks the logs of some users as changed. Call it after the commit.
+
+    Input:  user_ids (iterable of int)
+    Output: None
+    *******************************
+    """
+    global _total
+    with _lock:
+        for user_id in user_ids:
+            _versions[user_id] = _versions.get(user_id, 0) + 1
+        _total += 1
+
+
+def clear():
+    """
+    *******************************
+    Function: clear
+    -------------------
+    Marks the logs of every user as changed and drops every result,
+    e.g. after a compaction or after logs changed outside this process.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    global _epoch, _total, _used
+    with _lock:
+        _epoch += 1
+        _total += 1
+        _entries.clear()
+        _used = 0
+
+
+def get(key, current):
+    """
+    *******************************
+    Function: get
+    -------------------
+    Looks up a result and marks it as recently used. A result stored
+    under an older version is dropped.
+
+    Input:  key (tuple) - Query name and parameters
+            current (version) - From version()
+    Output: The stored result, or None if there is none
+    *******************************
+    """
+    global _used
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        stored, result, size = entry
+        if stored != current:
+            del _entries[key]
+            _used -= size
+            return None
+        _entries.move_to_end(key)
+        return result
+
+
+def put(key, stored, result, size):
+    """
+    *******************************
+    Function: put
+    -------------------
+    Stores a result, evicting the least recently used ones until the
+    cache fits in CACHE_BYTES. Results over ENTRY_BYTES are not kept.
+
+    Input:  key (tuple), stored (version) - Read before the query ran,
+            result, size (int) - Estimated bytes, see estimate_size()
+    Output: None
+    *******************************
+    """
+    global _used
+    if size > ENTRY_BYTES:
+        return
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _used -= old[2]
+        _entries[key] = (stored, result, size)
+        _used += size
+        while _used > CACHE_BYTES:
+            _, (_, _, evicted) = _entries.popitem(last=False)
+            _used -= evicted
+
+
+def estimate_size(rows):
+    """
+    *******************************
+    Function: estimate_size
+    -------------------
+    Estimates the memory held by a list of result rows from the size of
+    its first row, without walking every row.
+
+    Input:  rows (list of tuples)
+    Output: int - Bytes
+    *******************************
+    """
+    if not rows:
+        return sys.getsizeof(rows)
+    sample = rows[0]
+    row_size = sys.getsizeof(sample) + sum(sys.getsizeof(value) for value in sample)
+    return sys.getsizeof(rows) + len(rows) * row_size
+
+
+# ******************** Variables ************************
+_lock = threading.Lock()
+_entries = OrderedDict()    # key -> (version, result, size), least recently used first
+_used = 0                   # Bytes of all entries
+_versions = {}              # User ID -> write version
+_epoch = 0                  # Bumped when every user changes
+_total = 0                  # Bumped by every change
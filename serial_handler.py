@@ -6,20 +6,41 @@
 #
 # PROJECT....: PPG pulsefreq. and -oximetry meas.
 #
-# DESCRIPTION:  
+# DESCRIPTION:
 # A simple terminal application for collecting and exporting
 # biometric data from a serial interface. This module reads real-time
-# heart rate and oxygen saturation from a microcontroller and logs the
-# results to a database.
+# heart rate and oxygen saturation from one or more microcontrollers
+# and logs the results to a database through the local spool, so a
+# slow or unreachable database never stalls or loses readings.
+# Ingestion runs on an asyncio event loop: serial reads, the shared
+# parser and analytics stage, spool syncing, the dashboard and the
+# keyboard stop are cooperative tasks, so an idle session uses next to
+# no CPU. The dashboard redraws the latest state of every device at a
+# fixed frame rate, so terminal output costs the same at any sample
+# rate. Every stage records its metrics (see metrics.py). Runs on
+# Windows and POSIX systems.
 #
 # *****************************************************************************
 
+import os
+import sys
+import time
+import signal
+import asyncio
 import serial
-import threading
-import msvcrt
 from datetime import datetime
-from config import COMPORT, BAUDRATE
-from database import log_bpm, log_oxygen_level
+import config
+import metrics
+from protocol import LineFramer
+from analytics import VitalsAnalyzer
+from spool import get_spool, SPOOL_FILE, SYNC_INTERVAL, SYNC_BATCH
+
+# ********************** Constants ************************
+ESC = b'\x1b'
+KEY_POLL_INTERVAL = 0.05    # Seconds between keyboard polls on Windows
+READ_TIMEOUT = 0.1          # Seconds a threaded serial read may block
+FRAME_INTERVAL = 0.25       # Seconds between dashboard redraws on a terminal
+PLAIN_INTERVAL = 5.0        # Seconds between dashboard prints when output is not a terminal
 
 
 def log_bio(current_user_id, username="user"):
@@ -30,76 +51,497 @@ def log_bio(current_user_id, username="user"):
     Opens the serial port and listens for biometric data.
     Expects input lines in the format: "bpm:<value>oxy:<value>".
     Logs heart rate (BPM) and oxygen saturation (OXY%) to the database
-    under the specified user ID. Displays the values in a formatted table.
+    under the specified user ID through the local spool, which is
+    drained when leaving logging mode. Displays the values in a
+    formatted table.
 
     Press 'Esc' to exit logging mode.
 
-    Input:  
+    Input:
         current_user_id (int) - User ID as defined in the database
         username (str)        - Optional username (default: "user")
 
-    Output: 
+    Output:
         None
     *******************************
     """
+    log_bio_multi({config.COMPORT: current_user_id})
+
+
+def log_bio_multi(devices):
+    """
+    *******************************
+    Function: log_bio_multi
+    -------------------
+    Listens on several serial ports at once in one process and logs
+    each reading under the user ID mapped to its port. Prints
+    per-device throughput and a session summary of the accepted
+    readings when logging mode ends. Does nothing if another process
+    has the spool open.
+
+    Press 'Esc' to exit logging mode.
+
+    Input:  devices (dict) - {port (str): user_id (int)}
+    Output: None
+    *******************************
+    """
+    try:
+        get_spool()
+    except RuntimeError as e:
+        print(e)
+        return
     print("Entering Bio-Metrics logging mode. Press 'Esc' to exit.")
-    exit_flag = threading.Event()
+    start_time = datetime.now()
+    counters = asyncio.run(ingest(devices))
+    elapsed = max((datetime.now() - start_time).total_seconds(), 1e-9)
+    for port, counter in counters.items():
+        print(f"{port}: {counter['samples']} samples ({counter['samples'] / elapsed:.1f}/s), "
+              f"{counter['errors']} malformed lines")
+        for name, label in (('bpm', "BPM"), ('oxygen_level', "OXY%")):
+            stats = counter['session'][name]
+            if stats['accepted']:
+                print(f"  {label:<5} mean {stats['mean']:.1f}, min {stats['min']}, max {stats['max']}, "
+                      f"{stats['rejected']} rejected as artifacts")
+    print("Exiting Bio-Metrics logging mode.")
+
+
+async def ingest(devices, duration=None, keyboard=True, spool_path=SPOOL_FILE, on_open=None, stop_signals=False):
+    """
+    *******************************
+    Function: ingest
+    -------------------
+    Runs the ingestion engine until 'Esc' is pressed, a stop signal
+    arrives, the duration has passed or every port has failed. One reader task per port feeds
+    raw bytes to a shared parser task, which runs the analytics stage
+    and appends the readings to the spool; a syncer task fsyncs the
+    spool from a worker thread, and the spool's drainer thread loads it
+    into the database. On exit the drainer gets a few seconds to catch
+    up; whatever it could not load stays in the spool for later.
+
+    Input:  devices (dict)   - {port (str): user_id (int)}
+            duration (float or None) - Seconds to run, None for no limit
+            keyboard (bool)  - Stop on 'Esc' from the terminal
+            spool_path (str) - Spool file, see spool.get_spool
+            on_open (callable or None) - Called once every port is
+                               opened, before the first read
+            stop_signals (bool) - Stop on SIGINT/SIGTERM the way 'Esc'
+                               stops, see wait_for_signal
+    Output: dict - {port: {'samples', 'errors', 'session'}}, errors
+                   being the number of malformed lines and session the
+                   VitalsAnalyzer summary of the port; a port that could
+                   not be opened also has 'error', the reason
+    *******************************
+    """
+    loop = asyncio.get_running_loop()
+    spool = get_spool(spool_path)
+    chunks = asyncio.Queue()
+    latest = {}
+    sync_wanted = asyncio.Event()
+    analyzers = {port: VitalsAnalyzer() for port in devices}
+    counters = {port: {'samples': 0, 'errors': 0, 'session': analyzers[port].summary()} for port in devices}
     start_time = datetime.now()
 
-    def uart_listener():
+    baudrate = config.BAUDRATE
+    ports = {}
+    for port in devices:
         try:
-            ser = serial.Serial(COMPORT, BAUDRATE, timeout=1)
-            print(f"Listening on {COMPORT} at {BAUDRATE} baud...")
-            print(f"{'User_ID':<8}{'BPM':>8}{'OXY%':>8}{'Time':>10}")
-            while not exit_flag.is_set():
-                line = ser.readline().decode('utf-8').strip()
-                if not line:
-                    continue
-                try:
-                    now = datetime.now()
-                    elapsed = int((now - start_time).total_seconds())
-                    bpm = None
-                    oxygen_level = None
-                    if "bpm:" in line and "oxy:" in line:
-                        bpm_index = line.find("bpm:")
-                        oxy_index = line.find("oxy:")
-                        if bpm_index < oxy_index:
-                            bpm_part = line[bpm_index:oxy_index].strip()
-                            oxy_part = line[oxy_index:].strip()
-                        else:
-                            oxy_part = line[oxy_index:bpm_index].strip()
-                            bpm_part = line[bpm_index:].strip()
-                        if bpm_part.startswith("bpm:"):
-                            bpm = int(bpm_part.split(":")[1].strip())
-                            log_bpm(current_user_id, bpm, now)
-                        if oxy_part.startswith("oxy:"):
-                            oxygen_level = int(oxy_part.split(":")[1].strip())
-                            log_oxygen_level(current_user_id, oxygen_level, now)
-                    elif line.startswith("bpm:"):
-                        bpm = int(line.split(":")[1].strip())
-                        log_bpm(current_user_id, bpm, now)
-                    elif line.startswith("oxy:"):
-                        oxygen_level = int(line.split(":")[1].strip())
-                        log_oxygen_level(current_user_id, oxygen_level, now)
-
-                    if bpm is not None and oxygen_level is not None:
-                        print(f"{current_user_id:<8}{bpm:>8}{oxygen_level:>7}%{elapsed:>7}s")
-                except (ValueError, IndexError):
-                    print("Error parsing data. Ensure the format is correct.")
+            ports[port] = serial.Serial(port, baudrate, timeout=0)
+            print(f"Listening on {port} at {baudrate} baud...")
         except serial.SerialException as e:
-            print(f"Serial error: {e}")
-        finally:
-            if 'ser' in locals() and ser.is_open:
-                ser.close()
+            print(f"Serial error on {port}: {e}")
+            counters[port]['error'] = str(e)
+    if not ports:
+        return counters
+    if on_open is not None:
+        on_open()
 
-    listener_thread = threading.Thread(target=uart_listener)
-    listener_thread.start()
+    metrics.set_gauges({
+        'parser_queue_depth': ("Chunks waiting for the parser", chunks.qsize),
+        'spool_pending': ("Spooled readings not loaded into the database yet", spool.pending)
+    })
+    metrics_config = config.load_metrics_config()
+    if metrics_config['http_port']:
+        try:
+            metrics.start_http_server(int(metrics_config['http_port']))
+        except (OSError, ValueError) as e:
+            print(f"Metrics endpoint not started: {e}")
 
-    while not exit_flag.is_set():
-        if msvcrt.kbhit():
-            key = msvcrt.getch()
-            if key == b'\x1b':  # ESC key
-                exit_flag.set()
+    readers = [asyncio.create_task(read_serial(port, ser, chunks)) for port, ser in ports.items()]
+    parser = asyncio.create_task(parse_chunks(devices, analyzers, spool, chunks, latest, counters, sync_wanted))
+    syncer = asyncio.create_task(sync_spool(spool, sync_wanted))
+    dashboard = Dashboard(devices, latest, counters, analyzers, spool, start_time)
+    printer = asyncio.create_task(dashboard.run())
+    exporter = None
+    if metrics_config['textfile']:
+        exporter = asyncio.create_task(export_metrics(metrics_config['textfile']))
+    stoppers = []
+    if keyboard:
+        stoppers.append(asyncio.create_task(wait_for_escape()))
+    if stop_signals:
+        stoppers.append(asyncio.create_task(wait_for_signal()))
+    if duration is not None:
+        stoppers.append(asyncio.create_task(asyncio.sleep(duration)))
 
-    listener_thread.join()
-    print("Exiting Bio-Metrics logging mode.")
+    try:
+        pending = set(readers)
+        while pending:
+            done, pending = await asyncio.wait(pending | set(stoppers), return_when=asyncio.FIRST_COMPLETED)
+            if any(task in done for task in stoppers):
+                break
+            pending -= set(stoppers)
+    finally:
+        for task in readers + stoppers:
+            task.cancel()
+        await asyncio.gather(*readers, *stoppers, return_exceptions=True)
+        for ser in ports.values():
+            ser.close()
+        chunks.put_nowait(None)
+        await parser
+        syncer.cancel()
+        await asyncio.gather(syncer, return_exceptions=True)
+        await loop.run_in_executor(None, spool.sync)
+        printer.cancel()
+        await asyncio.gather(printer, return_exceptions=True)
+        drained = await loop.run_in_executor(None, spool.wait_drained)
+        dashboard.draw()
+        if not drained:
+            print(f"Database unavailable ({spool.last_error}); {spool.pending()} readings are kept "
+                  f"in '{spool.path}' and will be loaded once it is reachable.")
+        for port, analyzer in analyzers.items():
+            counters[port]['session'] = analyzer.summary()
+        metrics.set_gauges({'spool_pending': ("Spooled readings not loaded into the database yet", spool.pending)})
+        if exporter is not None:
+            exporter.cancel()
+            await asyncio.gather(exporter, return_exceptions=True)
+            try:
+                metrics.write_textfile(metrics_config['textfile'])
+            except OSError:
+                pass
+    return counters
+
+
+async def read_serial(port, ser, chunks):
+    """
+    *******************************
+    Function: read_serial
+    -------------------
+    Reads whatever bytes a serial port has waiting, in bulk, and queues
+    them with the port and their arrival time. On POSIX the loop wakes
+    up when the port's file descriptor becomes readable; on Windows
+    reads run in a worker thread with a short timeout instead, so their
+    read time includes the wait for data.
+
+    Input:  port (str), ser (serial.Serial), chunks (asyncio.Queue)
+    Output: None
+    *******************************
+    """
+    loop = asyncio.get_running_loop()
+    read_time = metrics.histogram('read')
+    use_selector = os.name != 'nt' and hasattr(ser, 'fileno')
+    if use_selector:
+        readable = asyncio.Event()
+        loop.add_reader(ser.fileno(), readable.set)
+    else:
+        ser.timeout = READ_TIMEOUT
+    try:
+        while True:
+            if use_selector:
+                await readable.wait()
+                readable.clear()
+                started = time.perf_counter()
+                data = ser.read(ser.in_waiting or 1)
+            else:
+                started = time.perf_counter()
+                data = await loop.run_in_executor(None, ser.read, max(1, ser.in_waiting))
+            if data:
+                arrived = time.perf_counter()
+                read_time.observe(arrived - started)
+                metrics.inc('bytes_read', len(data))
+                chunks.put_nowait((port, data, datetime.now(), arrived))
+    except serial.SerialException as e:
+        print(f"Serial error on {port}: {e}")
+    finally:
+        if use_selector:
+            loop.remove_reader(ser.fileno())
+
+
+async def parse_chunks(devices, analyzers, spool, chunks, latest, counters, sync_wanted):
+    """
+    *******************************
+    Function: parse_chunks
+    -------------------
+    Frames and parses the queued bytes of all ports, one LineFramer per
+    port, runs the samples through the port's analytics stage and
+    appends the raw and filtered readings to the spool until it
+    receives None. Asks the syncer for an fsync once SYNC_BATCH
+    readings were appended. Malformed lines are only counted. Only the
+    last reading of each chunk is kept for the dashboard.
+
+    Input:  devices (dict)      - {port: user_id}
+            analyzers (dict)    - {port: VitalsAnalyzer}
+            spool (Spool)
+            chunks (asyncio.Queue)  - (port, raw bytes, timestamp,
+                                       perf_counter arrival) tuples
+            latest (dict)       - {port: (reading, timestamp)}, updated
+            counters (dict)     - {port: {'samples', 'errors'}}, updated
+            sync_wanted (asyncio.Event)
+    Output: None
+    *******************************
+    """
+    framers = {port: LineFramer() for port in devices}
+    queue_wait, parse_time, append_time = (metrics.histogram(name) for name in ('queue_wait', 'parse', 'spool_append'))
+    unsynced = 0
+    while True:
+        item = await chunks.get()
+        if item is None:
+            return
+        port, data, now, arrived = item
+        started = time.perf_counter()
+        queue_wait.observe(started - arrived)
+        framer = framers[port]
+        samples = framer.feed(data)
+        metrics.inc('lines_malformed', framer.malformed - counters[port]['errors'])
+        counters[port]['errors'] = framer.malformed
+        if not samples:
+            parse_time.observe(time.perf_counter() - started)
+            continue
+        metrics.inc('samples_parsed', len(samples))
+        user_id = devices[port]
+        readings = analyzers[port].update(samples)
+        parsed = time.perf_counter()
+        parse_time.observe(parsed - started)
+        spool.append([(user_id, now) + reading for reading in readings])
+        append_time.observe(time.perf_counter() - parsed)
+        unsynced += len(readings)
+        if unsynced >= SYNC_BATCH:
+            sync_wanted.set()
+            unsynced = 0
+        counters[port]['samples'] = framer.samples
+        latest[port] = (readings[-1], now)
+
+
+async def sync_spool(spool, sync_wanted):
+    """
+    *******************************
+    Function: sync_spool
+    -------------------
+    Fsyncs the spool in a worker thread whenever the parser asks for
+    it or SYNC_INTERVAL seconds have passed, batching many readings
+    into one fsync.
+
+    Input:  spool (Spool), sync_wanted (asyncio.Event)
+    Output: None
+    *******************************
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await asyncio.wait_for(sync_wanted.wait(), SYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        sync_wanted.clear()
+        await loop.run_in_executor(None, spool.sync)
+
+
+async def export_metrics(path):
+    """
+    *******************************
+    Function: export_metrics
+    -------------------
+    Rewrites the Prometheus text file every TEXTFILE_INTERVAL seconds
+    while ingestion runs. A failed write is retried next time.
+
+    Input:  path (str)
+    Output: None
+    *******************************
+    """
+    while True:
+        try:
+            metrics.write_textfile(path)
+        except OSError:
+            pass
+        await asyncio.sleep(metrics.TEXTFILE_INTERVAL)
+
+
+class Dashboard:
+    """
+    *******************************
+    Class: Dashboard
+    -------------------
+    Live view of logging mode: one row per device with the latest raw
+    values, their moving averages ('-' for a missing value or rejected
+    artifact), samples, sample rate, malformed lines and rejected
+    artifacts, plus a line of ingest stats. On a terminal the frame is
+    redrawn in place with ANSI escape codes every FRAME_INTERVAL
+    seconds; otherwise it is printed every PLAIN_INTERVAL seconds.
+    Either way drawing costs the same however fast samples arrive.
+
+    Attributes:
+        interactive (bool) - Output is a terminal, frames are redrawn in place
+    *******************************
+    """
+
+    def __init__(self, devices, latest, counters, analyzers, spool, start_time):
+        self.devices = devices
+        self.latest = latest
+        self.counters = counters
+        self.analyzers = analyzers
+        self.spool = spool
+        self.start_time = start_time
+        self.interactive = sys.stdout.isatty()
+        self.drawn = 0
+        self.previous = {port: 0 for port in devices}
+        self.previous_time = time.monotonic()
+        if self.interactive and os.name == 'nt':
+            os.system("")   # Turns on ANSI escape codes in the Windows console
+
+    def frame(self):
+        """
+        *******************************
+        Function: frame
+        -------------------
+        Builds the lines of one frame from the current state. Sample
+        rates are measured since the previous frame.
+
+        Input:  None
+        Output: list of str
+        *******************************
+        """
+        now = time.monotonic()
+        interval = max(now - self.previous_time, 1e-9)
+        self.previous_time = now
+        lines = [f"{'Port':<14}{'User_ID':<8}{'BPM':>6}{'avg':>6}{'OXY%':>6}{'avg':>6}"
+                 f"{'Samples':>10}{'Rate/s':>9}{'Malformed':>11}{'Rejected':>10}"]
+        for port, user_id in self.devices.items():
+            counter = self.counters[port]
+            if 'error' in counter:
+                lines.append(f"{port:<14}{user_id:<8}  not open: {counter['error']}")
+                continue
+            reading, _ = self.latest.get(port, ((None,) * 4, None))
+            bpm, oxygen_level, bpm_filtered, oxygen_filtered = ("-" if value is None else value for value in reading)
+            rate = (counter['samples'] - self.previous[port]) / interval
+            self.previous[port] = counter['samples']
+            rejected = sum(stats['rejected'] for stats in self.analyzers[port].session.values())
+            lines.append(f"{port:<14}{user_id:<8}{bpm:>6}{bpm_filtered:>6}{oxygen_level:>5}%{oxygen_filtered:>6}"
+                         f"{counter['samples']:>10}{rate:>9.1f}{counter['errors']:>11}{rejected:>10}")
+        elapsed = int((datetime.now() - self.start_time).total_seconds())
+        commit = metrics.histogram('db_commit').quantile(0.99)
+        status = f"{elapsed}s  {self.spool.pending()} readings spooled, {metrics.counter('rows_committed')} committed"
+        if commit is not None:
+            status += f", commit p99 {commit * 1000.0:.1f} ms"
+        if self.spool.last_error is not None:
+            status += "  (database unavailable)"
+        lines.append(status)
+        return lines
+
+    def draw(self):
+        """
+        *******************************
+        Function: draw
+        -------------------
+        Writes one frame in a single write, over the previous one on a
+        terminal.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        lines = self.frame()
+        if self.interactive:
+            text = (f"\x1b[{self.drawn}F" if self.drawn else "") + "".join(f"{line}\x1b[K\n" for line in lines)
+            self.drawn = len(lines)
+        else:
+            text = "\n".join(lines) + "\n"
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    async def run(self):
+        """
+        *******************************
+        Function: run
+        -------------------
+        Render loop: draws a frame, then sleeps until the next one,
+        until cancelled.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        interval = FRAME_INTERVAL if self.interactive else PLAIN_INTERVAL
+        while True:
+            self.draw()
+            await asyncio.sleep(interval)
+
+
+async def wait_for_signal():
+    """
+    *******************************
+    Function: wait_for_signal
+    -------------------
+    Returns when SIGINT or SIGTERM arrives, instead of letting it
+    interrupt the program. The previous handlers are back in place
+    once it returns or is cancelled, so a second signal, e.g. while
+    the spool drains, interrupts as usual.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    loop = asyncio.get_running_loop()
+    received = asyncio.Event()
+
+    def on_signal(signum, frame):
+        loop.call_soon_threadsafe(received.set)
+
+    numbers = [signal.SIGINT] + ([signal.SIGTERM] if hasattr(signal, 'SIGTERM') else [])
+    saved = {number: signal.signal(number, on_signal) for number in numbers}
+    try:
+        await received.wait()
+    finally:
+        for number, handler in saved.items():
+            signal.signal(number, handler)
+
+
+async def wait_for_escape():
+    """
+    *******************************
+    Function: wait_for_escape
+    -------------------
+    Returns when 'Esc' is pressed. On POSIX the terminal is switched to
+    cbreak mode and stdin is watched by the event loop; on Windows the
+    keyboard is polled every KEY_POLL_INTERVAL seconds. Without a
+    terminal it waits until cancelled.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    if os.name == 'nt':
+        import msvcrt
+        while True:
+            while msvcrt.kbhit():
+                if msvcrt.getch() == ESC:
+                    return
+            await asyncio.sleep(KEY_POLL_INTERVAL)
+
+    fd = sys.stdin.fileno()
+    if not os.isatty(fd):
+        await asyncio.Event().wait()
+
+    import termios
+    import tty
+    loop = asyncio.get_running_loop()
+    pressed = asyncio.Event()
+
+    def on_key():
+        if ESC in os.read(fd, 64):
+            pressed.set()
+
+    saved = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+    loop.add_reader(fd, on_key)
+    try:
+        await pressed.wait()
+    finally:
+        loop.remove_reader(fd)
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
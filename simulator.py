@@ -0,0 +1,202 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: simulator.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module simulates the microcontroller on Linux:
+# every virtual device is a pseudo-terminal that emits
+# "bpm:<n>oxy:<n>" lines at a configurable rate, with optional timing
+# jitter and a share of malformed lines. The slave side of each pty
+# can be opened like any serial port, e.g. with 'set_comport'.
+#
+# Usage: python simulator.py --devices 2 --rate 100 --jitter 0.1 --malformed 0.05
+#
+# *****************************************************************************
+
+import os
+import pty
+import tty
+import time
+import random
+import argparse
+import threading
+
+# ********************** Constants ************************
+MAX_SLEEP = 0.05            # Longest pause between two writes (seconds)
+GARBAGE = (b"bpm:\r\n", b"oxy:abc\r\n", b"#debug 42\r\n", b"\xff\xfe\x00\r\n", b"bpm:7oxy\r\n")
+
+
+def open_virtual_device():
+    """
+    *******************************
+    Function: open_virtual_device
+    -------------------
+    Opens a pseudo-terminal in raw mode. The slave side is kept open
+    so lines written before a reader attaches are buffered, not lost.
+
+    Input:  None
+    Output: Tuple (master_fd, slave_fd, port) - port is the slave path
+    *******************************
+    """
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def start_simulator(devices=1, rate=100.0, jitter=0.0, malformed=0.0, seed=None, start=True):
+    """
+    *******************************
+    Function: start_simulator
+    -------------------
+    Opens the virtual devices and starts one writer thread per device.
+    Each device records the time.monotonic() send time of every valid
+    sample in device['sent'], in the order they were sent. With start
+    False the writers wait for start_writers, e.g. until a reader has
+    opened the ports (opening a port discards what is waiting in it).
+
+    Input:  devices (int)     - Number of virtual devices
+            rate (float)      - Lines per second per device
+            jitter (float)    - Random variation of each pause, as a
+                                fraction of the line interval (0..1)
+            malformed (float) - Share of lines that are garbage (0..1)
+            seed (int or None) - Random seed for repeatable runs
+            start (bool)      - Start the writer threads now
+    Output: list of dict - One entry per device with keys 'port',
+            'master', 'slave', 'sent', 'malformed', 'stop', 'thread'
+    *******************************
+    """
+    stop = threading.Event()
+    simulated = []
+    for index in range(devices):
+        master, slave, port = open_virtual_device()
+        device = {'port': port, 'master': master, 'slave': slave, 'sent': [], 'malformed': 0, 'stop': stop}
+        device['thread'] = threading.Thread(
+            target=emit_lines,
+            args=(device, rate, jitter, malformed, random.Random(None if seed is None else seed + index)),
+            daemon=True
+        )
+        simulated.append(device)
+    if start:
+        start_writers(simulated)
+    return simulated
+
+
+def start_writers(simulated):
+    """
+    *******************************
+    Function: start_writers
+    -------------------
+    Starts the writer threads of devices opened with start=False.
+
+    Input:  simulated (list of dict) - Result of start_simulator
+    Output: None
+    *******************************
+    """
+    for device in simulated:
+        device['thread'].start()
+
+
+def stop_simulator(simulated):
+    """
+    *******************************
+    Function: stop_simulator
+    -------------------
+    Stops the writer threads and closes the virtual devices. A writer
+    blocked on a full pty is abandoned after a second (daemon thread).
+
+    Input:  simulated (list of dict) - Result of start_simulator
+    Output: None
+    *******************************
+    """
+    if not simulated:
+        return
+    simulated[0]['stop'].set()
+    for device in simulated:
+        if device['thread'].ident is not None:
+            device['thread'].join(timeout=1.0)
+        os.close(device['slave'])
+        os.close(device['master'])
+
+
+def emit_lines(device, rate, jitter, malformed, rng):
+    """
+    *******************************
+    Function: emit_lines
+    -------------------
+    Writes lines to one virtual device until stopped. Lines are
+    scheduled against the start time, so a late wake-up sends every
+    line that is due in one write instead of drifting behind the rate.
+
+    Input:  device (dict), rate (float), jitter (float),
+            malformed (float), rng (random.Random)
+    Output: None
+    *******************************
+    """
+    master = device['master']
+    sent = device['sent']
+    interval = 1.0 / rate
+    start = time.monotonic()
+    count = 0
+    while not device['stop'].is_set():
+        due = int((time.monotonic() - start) * rate) + 1 - count
+        if due > 0:
+            lines = []
+            valid = 0
+            for _ in range(due):
+                if malformed and rng.random() < malformed:
+                    lines.append(rng.choice(GARBAGE))
+                    device['malformed'] += 1
+                else:
+                    lines.append(b"bpm:%doxy:%d\r\n" % (rng.randint(55, 110), rng.randint(90, 100)))
+                    valid += 1
+            try:
+                os.write(master, b"".join(lines))
+            except OSError:
+                return
+            now = time.monotonic()
+            sent.extend([now] * valid)
+            count += due
+        pause = interval * (1.0 + rng.uniform(-jitter, jitter)) if jitter else interval
+        time.sleep(min(max(pause, 0.0), MAX_SLEEP))
+
+
+def main():
+    """
+    *******************************
+    Function: main
+    -------------------
+    Runs the simulator from the command line until Ctrl+C and prints
+    the port of each virtual device.
+
+    Input:  None
+    Output: None
+    *******************************
+    """
+    parser = argparse.ArgumentParser(description="Virtual bpm/oxy serial devices")
+    parser.add_argument("--devices", type=int, default=1, help="number of virtual devices")
+    parser.add_argument("--rate", type=float, default=100.0, help="lines per second per device")
+    parser.add_argument("--jitter", type=float, default=0.0, help="pause variation as a fraction of the interval")
+    parser.add_argument("--malformed", type=float, default=0.0, help="share of garbage lines")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    args = parser.parse_args()
+
+    simulated = start_simulator(args.devices, args.rate, args.jitter, args.malformed, args.seed)
+    for device in simulated:
+        print(f"Virtual device on {device['port']}")
+    print("Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_simulator(simulated)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: spool.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module is the durable local spool between
+# ingestion and the database. Readings are appended to a local file
+# as fixed-size records and fsync'ed in batches; a background drainer
+# bulk-loads them into the database whenever it is reachable and
+# records how far it got in a checkpoint file. Ingestion therefore
+# never waits for, or loses data to, the database. Readings the drainer
+# did not load yet are replayed on the next start. Loading is
+# at-least-once: a crash between a commit and its checkpoint loads
+# that batch again. Records the database refuses (bad data rather than
+# a lost connection) are moved to "<spool>.rejected", in the same
+# record format, so they cannot block the records behind them; rename
+# that file to a spool to load them again. A spool file belongs to one
+# process at a time, which holds a lock on "<spool>.lock" while open.
+# *****************************************************************************
+
+import os
+import time
+import struct
+import threading
+from datetime import datetime, timedelta
+import metrics
+import database
+from database import insert_vitals
+
+# ********************** Constants ************************
+SPOOL_FILE = "vitals.spool"
+SYNC_INTERVAL = 0.2         # Seconds between fsyncs while ingesting
+SYNC_BATCH = 200            # Appended records that trigger an early fsync
+DRAIN_BATCH = 5000          # Records per database transaction
+DRAIN_INTERVAL = 0.2        # Seconds the drainer sleeps when caught up
+RETRY_MAX = 30.0            # Longest pause between retries while the database is down
+DRAIN_TIMEOUT = 5.0         # Seconds logging mode waits for the spool to drain
+NONE = 0xFFFF               # Stored for a missing value
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# user_id, microseconds since EPOCH, bpm, oxygen_level, bpm_filtered, oxygen_filtered
+RECORD = struct.Struct("<IqHHHH")
+
+
+def pack_rows(rows):
+    """
+    *******************************
+    Function: pack_rows
+    -------------------
+    Encodes vitals rows as spool records.
+
+    Input:  rows (list of tuples) - (user_id, timestamp, bpm, oxygen_level,
+                                     bpm_filtered, oxygen_filtered)
+    Output: bytes
+    *******************************
+    """
+    pack = RECORD.pack
+    return b"".join(
+        pack(user_id, (timestamp - EPOCH) // MICROSECOND, *(NONE if v is None else v for v in values))
+        for user_id, timestamp, *values in rows
+    )
+
+
+def unpack_rows(data):
+    """
+    *******************************
+    Function: unpack_rows
+    -------------------
+    Decodes spool records back into vitals rows.
+
+    Input:  data (bytes) - Whole records
+    Output: list of tuples - As accepted by pack_rows
+    *******************************
+    """
+    return [
+        (user_id, EPOCH + micros * MICROSECOND, *(None if v == NONE else v for v in values))
+        for user_id, micros, *values in RECORD.iter_unpack(data)
+    ]
+
+
+def read_position(path):
+    """
+    *******************************
+    Function: read_position
+    -------------------
+    Reads the checkpoint of a spool: the byte offset up to which its
+    records are loaded into the database.
+
+    Input:  path (str) - Spool file
+    Output: int - 0 without a checkpoint
+    *******************************
+    """
+    try:
+        with open(path + ".pos", "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def spool_pending(path=SPOOL_FILE):
+    """
+    *******************************
+    Function: spool_pending
+    -------------------
+    Counts the records of a spool file that are not loaded yet,
+    without opening the spool or the database.
+
+    Input:  path (str)
+    Output: int
+    *******************************
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+    position = read_position(path)
+    if position > size:
+        position = 0
+    return (size - position) // RECORD.size
+
+
+class Spool:
+    """
+    *******************************
+    Class: Spool
+    -------------------
+    Append-only spool file with a background drainer thread. Writers
+    call append() and, in batches, sync(); only synced records are
+    loaded, so a reading reaches the database only once it is safe on
+    disk. The file is emptied whenever everything in it is loaded.
+
+    Opening a spool that another process has open raises RuntimeError.
+
+    Attributes:
+        path (str)        - Spool file
+        last_error (Exception or None) - Why the last load failed
+        last_rejection (Exception or None) - Why records were last
+                            moved to the reject file
+    *******************************
+    """
+
+    def __init__(self, path=SPOOL_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.wanted = threading.Event()
+        self.stopping = threading.Event()
+        self.last_error = None
+        self.last_rejection = None
+        self.drainer = None
+
+        self.lock_file = open(path + ".lock", "a")
+        try:
+            _lock_file(self.lock_file)
+        except OSError:
+            self.lock_file.close()
+            raise RuntimeError(f"The spool '{path}' is in use by another process; "
+                               f"use a spool file of its own for this one.") from None
+        self.file = open(path, "ab")
+        size = self.file.tell()
+        if size % RECORD.size:
+            # A record torn by a crash while it was written
+            size -= size % RECORD.size
+            self.file.truncate(size)
+            self.file.seek(size)
+        self.synced = size
+        self.loaded = read_position(path)
+        if self.loaded > size:
+            self.loaded = 0
+
+    def append(self, rows):
+        """
+        *******************************
+        Function: append
+        -------------------
+        Appends rows to the spool. They are durable after the next sync.
+
+        Input:  rows (list of tuples) - See pack_rows
+        Output: None
+        *******************************
+        """
+        data = pack_rows(rows)
+        with self.lock:
+            self.file.write(data)
+        metrics.inc('readings_spooled', len(rows))
+
+    def sync(self):
+        """
+        *******************************
+        Function: sync
+        -------------------
+        Writes appended records to disk with fsync and wakes the drainer.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        started = time.perf_counter()
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.synced = self.file.tell()
+        metrics.observe('spool_sync', time.perf_counter() - started)
+        self.wanted.set()
+
+    def pending(self):
+        """
+        *******************************
+        Function: pending
+        -------------------
+        Returns the number of appended records not loaded yet.
+
+        Input:  None
+        Output: int
+        *******************************
+        """
+        with self.lock:
+            return (self.file.tell() - self.loaded) // RECORD.size
+
+    def drain_once(self, batch=DRAIN_BATCH):
+        """
+        *******************************
+        Function: drain_once
+        -------------------
+        Loads the next batch of synced records into the database in one
+        transaction and moves the checkpoint past it. Empties the spool
+        file once every record in it is loaded. Never prompts for
+        database settings; connection errors are raised. If the
+        database refuses the batch's data, the batch is split until
+        the refused records are found; those go to the reject file and
+        the rest is loaded.
+
+        Input:  batch (int) - Most records to load
+        Output: int - Number of records loaded or rejected
+        *******************************
+        """
+        with self.lock:
+            start = self.loaded
+            end = min(self.synced, start + batch * RECORD.size)
+        if end <= start:
+            return 0
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            rows = unpack_rows(f.read(end - start))
+        if not rows:
+            return 0
+        rejected = self._load(rows)
+        if rejected:
+            self._reject(rejected)
+        if len(rejected) < len(rows):
+            metrics.observe('end_to_end', (datetime.now() - rows[0][1]).total_seconds())
+
+        with self.lock:
+            self.loaded = end
+            if end == self.synced and self.file.tell() == end:
+                self.file.truncate(0)
+                self.file.seek(0)
+                self.loaded = self.synced = 0
+            self._write_position()
+        return len(rows)
+
+    def _load(self, rows):
+        """
+        *******************************
+        Function: _load
+        -------------------
+        Inserts rows in one transaction. If the database refuses them
+        for their data (any error but a connection error, see the
+        backend's RETRY_ERRORS), loads the two halves separately, down
+        to single rows.
+
+        Input:  rows (list of tuples) - See pack_rows
+        Output: list of tuples - The refused rows
+        *******************************
+        """
+        try:
+            insert_vitals(rows, prompt=False)
+            return []
+        except Exception as e:
+            backend = database.backend
+            if backend is None or not isinstance(e, backend.Error) or isinstance(e, backend.RETRY_ERRORS):
+                raise
+            self.last_rejection = e
+            if len(rows) == 1:
+                return rows
+        middle = len(rows) // 2
+        return self._load(rows[:middle]) + self._load(rows[middle:])
+
+    def _reject(self, rows):
+        """
+        *******************************
+        Function: _reject
+        -------------------
+        Appends refused rows to the reject file and syncs it, before
+        the checkpoint moves past them.
+
+        Input:  rows (list of tuples) - See pack_rows
+        Output: None
+        *******************************
+        """
+        with open(self.path + ".rejected", "ab") as f:
+            f.write(pack_rows(rows))
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.inc('readings_rejected', len(rows))
+
+    def _write_position(self):
+        """
+        *******************************
+        Function: _write_position
+        -------------------
+        Saves the checkpoint by replacing the position file, so a crash
+        leaves either the old or the new offset. Called with the lock held.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        temporary = self.path + ".pos.tmp"
+        with open(temporary, "w") as f:
+            f.write(str(self.loaded))
+        os.replace(temporary, self.path + ".pos")
+
+    def start(self):
+        """
+        *******************************
+        Function: start
+        -------------------
+        Starts the drainer thread, which first replays what an earlier
+        run left behind.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        if self.drainer is None:
+            self.stopping.clear()
+            self.drainer = threading.Thread(target=self._drain_loop, name="spool-drainer", daemon=True)
+            self.drainer.start()
+            self.wanted.set()
+
+    def _drain_loop(self):
+        """
+        *******************************
+        Function: _drain_loop
+        -------------------
+        Drainer thread: loads batches while there are any, otherwise
+        waits to be woken by sync(). While the database is unreachable
+        it retries with a doubling pause, up to RETRY_MAX seconds,
+        which wake-ups do not cut short. Only connection errors get
+        here; records the database refuses are rejected by drain_once
+        instead of being retried forever.
+
+        Input:  None
+        Output: None
+        *******************************
+        """
+        pause = DRAIN_INTERVAL
+        while not self.stopping.is_set():
+            self.wanted.clear()
+            try:
+                loaded = self.drain_once()
+                self.last_error = None
+                pause = DRAIN_INTERVAL
+            except Exception as e:
+                self.last_error = e
+                metrics.inc('db_errors')
+                pause = min(pause * 2, RETRY_MAX)
+                self.stopping.wait(pause)
+                continue
+            if not loaded:
+                self.wanted.wait(pause)
+
+    def wait_drained(self, timeout=DRAIN_TIMEOUT):
+        """
+        *******************************
+        Function: wait_drained
+        -------------------
+        Waits until every appended record is loaded, the timeout has
+        passed or loading failed. Records left behind stay in the spool.
+
+        Input:  timeout (float) - Seconds
+        Output: bool - True if the spool is drained
+        *******************************
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending():
+            if time.monotonic() >= deadline or self.last_error is not None:
+                return False
+            self.wanted.set()
+            time.sleep(DRAIN_INTERVAL / 4)
+        return True
+
+    def close(self, timeout=DRAIN_TIMEOUT):
+        """
+        *******************************
+        Function: close
+        -------------------
+        Syncs, gives the drainer up to timeout seconds to catch up,
+        stops it and closes the file.
+
+        Input:  timeout (float) - Seconds
+        Output: None
+        *******************************
+        """
+        self.sync()
+        if self.drainer is not None:
+            self.wait_drained(timeout)
+            self.stopping.set()
+            self.wanted.set()
+            self.drainer.join(timeout)
+            self.drainer = None
+        with self.lock:
+            self.file.close()
+        self.lock_file.close()
+
+
+def _lock_file(f):
+    """
+    *******************************
+    Function: _lock_file
+    -------------------
+    Takes an exclusive lock on an open file without waiting. The lock
+    is released when the file is closed, also when the process dies.
+
+    Input:  f (file) - Opened for writing
+    Output: None - Raises OSError if another process holds the lock
+    *******************************
+    """
+    if os.name == 'nt':
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def get_spool(path=SPOOL_FILE):
+    """
+    *******************************
+    Function: get_spool
+    -------------------
+    Returns the spool of this process, opening it and starting its
+    drainer on first use.
+
+    Input:  path (str) - Spool file, used on first call only
+    Output: Spool
+    *******************************
+    """
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = Spool(path)
+            _spool.start()
+        return _spool
+
+
+def close_spool(timeout=DRAIN_TIMEOUT):
+    """
+    *******************************
+    Function: close_spool
+    -------------------
+    Closes the spool of this process, if it was opened.
+
+    Input:  timeout (float) - Seconds to wait for the drainer
+    Output: None
+    *******************************
+    """
+    global _spool
+    with _spool_lock:
+        spool, _spool = _spool, None
+    if spool is not None:
+        spool.close(timeout)
+
+
+# ******************** Variables ************************
+_spool = None
+_spool_lock = threading.Lock()
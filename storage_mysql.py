@@ -0,0 +1,185 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: storage_mysql.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module is the MySQL storage backend used by
+# database.py. The schema is created by setupDatabase.sql.
+# *****************************************************************************
+
+import os
+import tempfile
+from datetime import datetime
+import mysql.connector
+
+# ********************** Constants ************************
+NAME = "mysql"
+PROMPT_ON_FAILURE = True    # Ask for new credentials when connecting fails
+Error = mysql.connector.Error
+RETRY_ERRORS = (            # Errors of the connection, not of the statement or its data
+    mysql.connector.errors.OperationalError,
+    mysql.connector.errors.InterfaceError
+)
+
+
+def connect(db_config):
+    """
+    *******************************
+    Function: connect
+    -------------------
+    Opens a connection to the MySQL server described by db_config.
+    Local infile is allowed for bulk_insert; the server must have
+    local_infile enabled as well.
+
+    Input:  db_config (dict) - host, user, password, database
+    Output: mysql.connector.MySQLConnection
+    *******************************
+    """
+    return mysql.connector.connect(
+        host=db_config['host'],
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['database'],
+        allow_local_infile=True
+    )
+
+
+def prepare(query):
+    """
+    *******************************
+    Function: prepare
+    -------------------
+    Returns the query in this backend's parameter style. database.py
+    writes queries with %s placeholders, which MySQL uses natively.
+
+    Input:  query (str)
+    Output: str
+    *******************************
+    """
+    return query
+
+
+def stream_cursor(conn):
+    """
+    *******************************
+    Function: stream_cursor
+    -------------------
+    Returns an unbuffered cursor, so fetchmany pulls rows from the
+    server as they are consumed instead of loading the whole result.
+
+    Input:  conn (mysql.connector.MySQLConnection)
+    Output: cursor
+    *******************************
+    """
+    return conn.cursor(buffered=False)
+
+
+def bulk_insert(cursor, table, columns, rows):
+    """
+    *******************************
+    Function: bulk_insert
+    -------------------
+    Loads rows into a table with LOAD DATA LOCAL INFILE from a
+    temporary tab-separated file, which is much faster than INSERT
+    statements. Falls back to executemany if the server refuses
+    local infile. The caller commits.
+
+    Input:  cursor, table (str), columns (tuple of str),
+            rows (list of tuples) - None is loaded as NULL
+    Output: None
+    *******************************
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8", newline="") as f:
+        for row in rows:
+            f.write("\t".join(
+                "\\N" if value is None
+                else value.isoformat(" ", "milliseconds") if isinstance(value, datetime)
+                else str(value)
+                for value in row
+            ) + "\n")
+    try:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+            f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join(columns)})",
+            (f.name,)
+        )
+    except Error:
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})", rows
+        )
+    finally:
+        os.unlink(f.name)
+
+
+def ping(conn):
+    """
+    *******************************
+    Function: ping
+    -------------------
+    Checks that a pooled connection still reaches the server, trying
+    one reconnect if the server closed it (e.g. after wait_timeout).
+
+    Input:  conn (mysql.connector.MySQLConnection)
+    Output: bool - True if the connection is usable
+    *******************************
+    """
+    try:
+        conn.ping(reconnect=True, attempts=1, delay=0)
+        return True
+    except Error:
+        return False
+
+
+def truncate_table(table):
+    """
+    *******************************
+    Function: truncate_table
+    -------------------
+    Returns the statement that empties a table at once. TRUNCATE drops
+    and recreates the table instead of deleting row by row.
+
+    Input:  table (str)
+    Output: str - SQL statement
+    *******************************
+    """
+    return f"TRUNCATE TABLE {table}"
+
+
+def truncate_time(column, bucket):
+    """
+    *******************************
+    Function: truncate_time
+    -------------------
+    Returns an expression that truncates a DATETIME column to the
+    start of its minute, hour or day. Written without DATE_FORMAT so
+    no '%' needs escaping in parameterized queries.
+
+    Input:  column (str), bucket (str) - 'minute', 'hour' or 'day'
+    Output: str - SQL expression
+    *******************************
+    """
+    if bucket == 'minute':
+        return f"DATE({column}) + INTERVAL (HOUR({column}) * 60 + MINUTE({column})) MINUTE"
+    if bucket == 'hour':
+        return f"DATE({column}) + INTERVAL HOUR({column}) HOUR"
+    return f"CAST(DATE({column}) AS DATETIME)"
+
+
+def time_bucket(column, bucket):
+    """
+    *******************************
+    Function: time_bucket
+    -------------------
+    Returns a select expression, aliased 'bucket', that truncates a
+    DATETIME column to the start of its minute, hour or day.
+
+    Input:  column (str), bucket (str) - 'minute', 'hour' or 'day'
+    Output: str - SQL expression
+    *******************************
+    """
+    return f"{truncate_time(column, bucket)} AS bucket"
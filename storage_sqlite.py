@@ -0,0 +1,330 @@
+# *****************************************************************************
+# University of Southern Denmark
+# Embedded C Programming (ECP)
+#
+# MODULENAME.: storage_sqlite.py
+#
+# PROJECT....: PPG pulsefreq. and -oximetry meas.
+#
+# DESCRIPTION:
+# A simple terminal application for collecting and exporting
+# biometric data. This module is the embedded SQLite storage backend
+# used by database.py. It needs no database server and is tuned for
+# high insert rates (WAL journal, relaxed fsync, statement cache).
+# *****************************************************************************
+
+import sqlite3
+from datetime import datetime
+from functools import lru_cache
+
+# ********************** Constants ************************
+NAME = "sqlite"
+PROMPT_ON_FAILURE = False   # A local file has no credentials to ask for
+Error = sqlite3.Error
+RETRY_ERRORS = (sqlite3.OperationalError, sqlite3.InterfaceError)  # e.g. "database is locked"
+STATEMENT_CACHE_SIZE = 256  # Compiled statements kept per connection
+BUCKET_FORMATS = {          # Same text form as stored time stamps, so they compare correctly
+    'minute': "%Y-%m-%d %H:%M:00.000",
+    'hour': "%Y-%m-%d %H:00:00.000",
+    'day': "%Y-%m-%d 00:00:00.000"
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    age INTEGER NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One row per reading; the index is ordered like the MySQL primary
+-- key (userID, time_stamp, id) and covers every column, so per-user
+-- history queries and keyset pages are range scans that never touch
+-- the table.
+CREATE TABLE IF NOT EXISTS vitals (
+    id INTEGER PRIMARY KEY,
+    userID INTEGER NOT NULL REFERENCES user(id),
+    time_stamp DATETIME NOT NULL,
+    bpm INTEGER,
+    oxygen_level INTEGER,
+    bpm_filtered INTEGER,
+    oxygen_filtered INTEGER
+);
+
+DROP INDEX IF EXISTS idx_vitals_user_time;
+CREATE INDEX IF NOT EXISTS idx_vitals_user_time_id
+    ON vitals (userID, time_stamp, id, bpm, oxygen_level);
+
+-- Rollups of compacted readings (see database.compact). A bucket may
+-- have several rows, one per compaction chunk; queries add them up.
+CREATE TABLE IF NOT EXISTS vitals_minute (
+    userID INTEGER NOT NULL REFERENCES user(id),
+    bucket DATETIME NOT NULL,
+    bpm_min INTEGER,
+    bpm_max INTEGER,
+    bpm_sum INTEGER NOT NULL,
+    bpm_count INTEGER NOT NULL,
+    oxygen_level_min INTEGER,
+    oxygen_level_max INTEGER,
+    oxygen_level_sum INTEGER NOT NULL,
+    oxygen_level_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_vitals_minute_user_bucket ON vitals_minute (userID, bucket);
+
+CREATE TABLE IF NOT EXISTS vitals_hour (
+    userID INTEGER NOT NULL REFERENCES user(id),
+    bucket DATETIME NOT NULL,
+    bpm_min INTEGER,
+    bpm_max INTEGER,
+    bpm_sum INTEGER NOT NULL,
+    bpm_count INTEGER NOT NULL,
+    oxygen_level_min INTEGER,
+    oxygen_level_max INTEGER,
+    oxygen_level_sum INTEGER NOT NULL,
+    oxygen_level_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_vitals_hour_user_bucket ON vitals_hour (userID, bucket);
+"""
+
+# Same pairing as migrateVitals.sql; the legacy SQLite tables already
+# stored full dates, so time stamps are copied as they are.
+MIGRATE_VITALS = """
+INSERT INTO vitals (userID, time_stamp, bpm, oxygen_level)
+WITH
+    b AS (
+        SELECT userID, time_stamp, bpm,
+               ROW_NUMBER() OVER (PARTITION BY userID, time_stamp ORDER BY id) AS n
+        FROM bpm_table
+    ),
+    o AS (
+        SELECT userID, time_stamp, oxygen_level,
+               ROW_NUMBER() OVER (PARTITION BY userID, time_stamp ORDER BY id) AS n
+        FROM oxygen_level_table
+    )
+SELECT b.userID, b.time_stamp, b.bpm, o.oxygen_level
+FROM b
+LEFT JOIN o ON o.userID = b.userID AND o.time_stamp = b.time_stamp AND o.n = b.n
+UNION ALL
+SELECT o.userID, o.time_stamp, NULL, o.oxygen_level
+FROM o
+LEFT JOIN b ON b.userID = o.userID AND b.time_stamp = o.time_stamp AND b.n = o.n
+WHERE b.userID IS NULL
+"""
+
+# Columns added to vitals after its first release
+ADDED_COLUMNS = {
+    'bpm_filtered': "INTEGER",
+    'oxygen_filtered': "INTEGER"
+}
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+def connect(db_config):
+    """
+    *******************************
+    Function: connect
+    -------------------
+    Opens (and if needed creates) the SQLite database file given by
+    db_config['path'], applies the WAL/fsync pragmas and makes sure
+    the schema exists.
+
+    Input:  db_config (dict) - path
+    Output: sqlite3.Connection
+    *******************************
+    """
+    conn = sqlite3.connect(
+        db_config['path'],
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    conn.executescript(SCHEMA)
+    migrate(conn)
+    conn.commit()
+    return conn
+
+
+def migrate(conn):
+    """
+    *******************************
+    Function: migrate
+    -------------------
+    Adds columns missing from an older vitals table, then moves
+    readings from the legacy bpm_table and oxygen_level_table into
+    vitals and drops the legacy tables, in one transaction. Does
+    nothing if the schema is current.
+
+    Input:  conn (sqlite3.Connection)
+    Output: None
+    *******************************
+    """
+    present = {row[1] for row in conn.execute("PRAGMA table_info(vitals)")}
+    for column, declaration in ADDED_COLUMNS.items():
+        if column not in present:
+            conn.execute(f"ALTER TABLE vitals ADD COLUMN {column} {declaration}")
+    legacy = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+        "AND name IN ('bpm_table', 'oxygen_level_table')"
+    ).fetchone()[0]
+    if legacy != 2:
+        return
+    with conn:
+        conn.execute(MIGRATE_VITALS)
+        conn.execute("DROP TABLE bpm_table")
+        conn.execute("DROP TABLE oxygen_level_table")
+
+
+@lru_cache(maxsize=None)
+def prepare(query):
+    """
+    *******************************
+    Function: prepare
+    -------------------
+    Rewrites the %s placeholders used by database.py to SQLite's ?
+    style. The result is cached so each query is translated once and
+    always hits the connection's compiled statement cache.
+
+    Input:  query (str)
+    Output: str
+    *******************************
+    """
+    return query.replace("%s", "?")
+
+
+def stream_cursor(conn):
+    """
+    *******************************
+    Function: stream_cursor
+    -------------------
+    Returns a cursor for streaming reads. SQLite cursors already step
+    through the result lazily, so a plain cursor is enough.
+
+    Input:  conn (sqlite3.Connection)
+    Output: sqlite3.Cursor
+    *******************************
+    """
+    return conn.cursor()
+
+
+def bulk_insert(cursor, table, columns, rows):
+    """
+    *******************************
+    Function: bulk_insert
+    -------------------
+    Inserts rows with one executemany, inside the caller's transaction.
+    The caller commits.
+
+    Input:  cursor, table (str), columns (tuple of str),
+            rows (list of tuples)
+    Output: None
+    *******************************
+    """
+    cursor.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", rows
+    )
+
+
+def ping(conn):
+    """
+    *******************************
+    Function: ping
+    -------------------
+    Checks that a pooled connection is still open and usable.
+
+    Input:  conn (sqlite3.Connection)
+    Output: bool - True if the connection is usable
+    *******************************
+    """
+    try:
+        conn.execute("SELECT 1")
+        return True
+    except Error:
+        return False
+
+
+def truncate_table(table):
+    """
+    *******************************
+    Function: truncate_table
+    -------------------
+    Returns the statement that empties a table at once. SQLite has no
+    TRUNCATE; a DELETE without WHERE uses its truncate optimization.
+
+    Input:  table (str)
+    Output: str - SQL statement
+    *******************************
+    """
+    return f"DELETE FROM {table}"
+
+
+def truncate_time(column, bucket):
+    """
+    *******************************
+    Function: truncate_time
+    -------------------
+    Returns an expression that truncates a DATETIME column to the
+    start of its minute, hour or day, as sortable text.
+
+    Input:  column (str), bucket (str) - 'minute', 'hour' or 'day'
+    Output: str - SQL expression
+    *******************************
+    """
+    return f"strftime('{BUCKET_FORMATS[bucket]}', {column})"
+
+
+def time_bucket(column, bucket):
+    """
+    *******************************
+    Function: time_bucket
+    -------------------
+    Returns a select expression, aliased 'bucket', that truncates a
+    DATETIME column to the start of its minute, hour or day. The
+    "[DATETIME]" alias suffix makes it come back as a datetime.
+
+    Input:  column (str), bucket (str) - 'minute', 'hour' or 'day'
+    Output: str - SQL expression
+    *******************************
+    """
+    return f"{truncate_time(column, bucket)} AS \"bucket [DATETIME]\""
+
+
+def _adapt_datetime(value):
+    """
+    *******************************
+    Function: _adapt_datetime
+    -------------------
+    Stores datetimes as sortable ISO text with millisecond precision.
+
+    Input:  value (datetime)
+    Output: str
+    *******************************
+    """
+    return value.isoformat(" ", timespec="milliseconds")
+
+
+def _convert_datetime(value):
+    """
+    *******************************
+    Function: _convert_datetime
+    -------------------
+    Reads DATETIME columns back as datetime objects, as MySQL does.
+
+    Input:  value (bytes)
+    Output: datetime
+    *******************************
+    """
+    return datetime.fromisoformat(value.decode())
+
+
+# ******************** Runtime Initialization ********************
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("DATETIME", _convert_datetime)